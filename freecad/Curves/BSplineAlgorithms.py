@@ -11,7 +11,9 @@ import FreeCAD
 import Part
 from FreeCAD import Base
 from math import pi
+import numpy as np
 from freecad.Curves.BSplineApproxInterp import BSplineApproxInterp
+from freecad.Curves.lib.aabb_tree import points_box
 
 vec2d = Base.Vector2d
 DEBUG = False
@@ -106,6 +108,16 @@ class SurfAdapterView(object):
             debug("failed to insert knot : %f - %d - %f" % (knot, mult, tolerance))
             raise RuntimeError
 
+    def insertKnots(self, knots, mults, tolerance=1e-15, add=True):
+        try:
+            if self.d == 0:
+                self.s.insertUKnots(knots, mults, tolerance, add)
+            else:
+                self.s.insertVKnots(knots, mults, tolerance, add)
+        except Part.OCCError:
+            debug("failed to insert knots : %s - %s - %f" % (knots, mults, tolerance))
+            raise RuntimeError
+
     def getKnot(self, idx):
         if self.d == 0:
             return self.s.getUKnot(idx)
@@ -299,44 +311,37 @@ class BSplineAlgorithms(object):
         #     if not (spline.NbKnots == firstSpline.NbKnots):
         #         self.error("Unexpected error in Algorithm makeGeometryCompatibleImpl.\nPlease contact the developers.")
 
-        # create a vector of all knots in chosen direction (u or v) of all splines
-        resultKnots = list()
-        for spline in splines_vector:
-            for k in spline.getKnots():
-                resultKnots.append(k)
-
-        # sort vector of all knots in given direction of all splines
-        resultKnots.sort()
-        prev = resultKnots[0]
-        unique = [prev]
-        for i in range(1, len(resultKnots)):
-            if abs(resultKnots[i] - prev) > par_tolerance:
-                unique.append(resultKnots[i])
-            prev = resultKnots[i]
-        resultKnots = unique
+        # merge the knot vectors of all splines, in a single sorted pass
+        knots_list = [np.array(spline.getKnots(), dtype=float) for spline in splines_vector]
+        mults_list = [np.array(spline.getMultiplicities(), dtype=int) for spline in splines_vector]
+        resultKnots = self.mergeKnots(np.concatenate(knots_list), par_tolerance)
 
         # find highest multiplicities
-        resultMults = [0] * len(resultKnots)
-        for spline in splines_vector:
-            for knotIdx in range(len(resultKnots)):
-                # get multiplicity of current knot in surface
-                splKnotIdx = self.findKnot(spline, resultKnots[knotIdx], par_tolerance)
-                if (splKnotIdx > -1):
-                    resultMults[knotIdx] = max(resultMults[knotIdx], spline.getMultiplicity(splKnotIdx + 1))
-
-        for spline in splines_vector:
-            # debug("\n%d - %d poles\n%s\n%s"%(spline.Degree, spline.NbPoles, spline.getKnots(), spline.getMultiplicities()))
-            for knotIdx in range(len(resultKnots)):
-                # get multiplicity of current knot in surface
-                splKnotIdx = self.findKnot(spline, resultKnots[knotIdx], par_tolerance)
-                if (splKnotIdx > -1):
-                    # print("getting mult {} / {}, periodic = {}".format(splKnotIdx + 1, len(spline.getMultiplicities()), spline.isPeriodic()))
-                    if int(spline.getMultiplicity(splKnotIdx + 1)) < resultMults[knotIdx]:
-                        # debug("increasing mult %f / %d"%(resultKnots[knotIdx], resultMults[knotIdx]))
-                        spline.increaseMultiplicity(splKnotIdx + 1, resultMults[knotIdx])
-                else:
-                    # debug("inserting knot %f / %d"%(resultKnots[knotIdx], resultMults[knotIdx]))
-                    spline.insertKnot(resultKnots[knotIdx], resultMults[knotIdx], par_tolerance)
+        groups = [np.searchsorted(resultKnots, knots, side='right') - 1 for knots in knots_list]
+        resultMults = np.zeros(len(resultKnots), dtype=int)
+        for group, mults in zip(groups, mults_list):
+            np.maximum.at(resultMults, group, mults)
+
+        # refine each spline with a single bulk knot insertion
+        for spline, knots, mults, group in zip(splines_vector, knots_list, mults_list, groups):
+            current = np.zeros(len(resultKnots), dtype=int)
+            current[group] = mults
+            missing = current < resultMults
+            if not missing.any():
+                continue
+            # existing knots keep their own value, so that they are not duplicated
+            target = resultKnots.copy()
+            target[group] = knots
+            spline.insertKnots(target[missing].tolist(), resultMults[missing].tolist(), par_tolerance, False)
+
+    def mergeKnots(self, knots, par_tolerance):
+        """Returns the sorted array of unique knots.
+        Consecutive knots closer than par_tolerance are merged into the first one"""
+        knots = np.sort(knots)
+        if len(knots) == 0:
+            return knots
+        keep = np.concatenate([[True], np.diff(knots) > par_tolerance])
+        return knots[keep]
 
     def createCommonKnotsVectorCurve(self, curves, tol):
         """Modify all the splines, so that they have the same knots / mults"""
@@ -399,12 +404,120 @@ class BSplineAlgorithms(object):
 
 # Below are the most important methods of BSplineAlgorithms
 
-    def intersections(self, spline1, spline2, tol3d):
-        """Returns a list of tuples (param1, param2) that are intersection parameters of spline1 with spline2"""
+    def spanBoxes(self, spline, tol=0.0):
+        """Returns the bounding boxes of the control polygon of each knot span of spline,
+        as an array of shape (nb_spans, 6), and the list of parameter ranges of the knot spans.
+        By the convex hull property, each box contains the matching curve segment"""
+        bs = spline
+        if spline.isPeriodic():
+            bs = spline.copy()
+            bs.setNotPeriodic()
+        poles = np.array([[p.x, p.y, p.z] for p in bs.getPoles()])
+        flatKnots = bs.KnotSequence
+        degree = bs.Degree
+        boxes = list()
+        ranges = list()
+        for span in range(degree, len(poles)):
+            if flatKnots[span + 1] > flatKnots[span]:
+                boxes.append(points_box(poles[span - degree:span + 1], tol))
+                ranges.append((flatKnots[span], flatKnots[span + 1]))
+        return np.array(boxes).reshape(-1, 6), ranges
+
+    def refineIntersection(self, spline1, spline2, param1, param2, tol3d, maxIter=20):
+        """Refine the intersection parameters of spline1 and spline2 from an initial guess,
+        by Gauss-Newton minimization of the distance between the two curves.
+        Returns [param1, param2], or None if the distance is over tol3d"""
+        u0, u1 = spline1.FirstParameter, spline1.LastParameter
+        v0, v1 = spline2.FirstParameter, spline2.LastParameter
+        for i in range(maxIter):
+            p1, d1 = spline1.getD1(param1)
+            p2, d2 = spline2.getD1(param2)
+            r = p1 - p2
+            a = d1.dot(d1)
+            b = -d1.dot(d2)
+            c = d2.dot(d2)
+            g1 = d1.dot(r)
+            g2 = -d2.dot(r)
+            det = a * c - b * b
+            if abs(det) < 1e-30:
+                break
+            dp1 = -(c * g1 - b * g2) / det
+            dp2 = -(a * g2 - b * g1) / det
+            param1 = min(max(param1 + dp1, u0), u1)
+            param2 = min(max(param2 + dp2, v0), v1)
+            if abs(dp1) < self.tol and abs(dp2) < self.tol:
+                break
+        if spline1.value(param1).distanceToPoint(spline2.value(param2)) < tol3d:
+            return [param1, param2]
+        return None
+
+    def closedIntersections(self, spline1, spline2, param1, param2):
+        """Returns the missing intersection parameters of closed curves,
+        when a single intersection has been found at the seam"""
+        result = list()
+        if spline1.isClosed():
+            if abs(param1 - spline1.getKnot(1)) < self.tol:
+                # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the end of the closed curve, so add it by hand
+                result.append([spline1.getKnot(spline1.NbKnots), param2])
+            if abs(param1 - spline1.getKnot(spline1.NbKnots)) < self.tol:
+                # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the beginning of the closed curve, so add it by hand
+                result.append([spline1.getKnot(1), param2])
+        elif spline2.isClosed():
+            if abs(param2 - spline2.getKnot(1)) < self.tol:
+                # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the end of the closed curve, so add it by hand
+                result.append([param1, spline2.getKnot(spline2.NbKnots)])
+            if abs(param2 - spline2.getKnot(spline2.NbKnots)) < self.tol:
+                # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the beginning of the closed curve, so add it by hand
+                result.append([param1, spline2.getKnot(1)])
+        return result
+
+    def seededIntersections(self, spline1, spline2, tol3d, seeds):
+        """Returns a list of intersection parameters of spline1 with spline2
+        computed from seeds, a list of parameter ranges (s0, s1, t0, t1)
+        of curve segments that may intersect.
+        The seeds are refined in order of increasing distance of their midpoints,
+        and skipped if they already contain a found intersection.
+        Refined intersections closer than tol3d to a found one are duplicates"""
+        candidates = list()
+        for s0, s1, t0, t1 in seeds:
+            d = spline1.value(0.5 * (s0 + s1)).distanceToPoint(spline2.value(0.5 * (t0 + t1)))
+            candidates.append((d, s0, s1, t0, t1))
+        candidates.sort()
+        found = list()
+        points = list()
+        for d, s0, s1, t0, t1 in candidates:
+            if any([(s0 <= f[0] <= s1) and (t0 <= f[1] <= t1) for f in found]):
+                continue
+            res = self.refineIntersection(spline1, spline2, 0.5 * (s0 + s1), 0.5 * (t0 + t1), tol3d)
+            if res is None:
+                continue
+            pt = spline1.value(res[0])
+            if any([pt.distanceToPoint(p) < tol3d for p in points]):
+                continue
+            found.append(res)
+            points.append(pt)
+        found.sort()
+        if len(found) == 1:
+            found.extend(self.closedIntersections(spline1, spline2, found[0][0], found[0][1]))
+        return found
+
+    def intersections(self, spline1, spline2, tol3d, seeds=None):
+        """Returns a list of tuples (param1, param2) that are intersection parameters of spline1 with spline2
+        seeds is an optional list of parameter ranges (s0, s1, t0, t1) of curve segments that may intersect.
+        intersectCC is skipped if the seeds give the expected intersections :
+        a single one, and its twin at the seam of closed curves"""
         # light weight simple minimizer
         # check parametrization of B-splines beforehand
         # find out the average scale of the two B-splines in order to being able to handle a more approximate curves and find its intersections
         splines_scale = (self.scale(spline1) + self.scale(spline2)) / 2.
+        if seeds:
+            intersection_params_vector = self.seededIntersections(spline1, spline2, tol3d * splines_scale, seeds)
+            if intersection_params_vector:
+                first = intersection_params_vector[0]
+                expected = 1 + len(self.closedIntersections(spline1, spline2, first[0], first[1]))
+                if len(intersection_params_vector) == expected:
+                    return intersection_params_vector
+            debug("seeded intersection failed !")
         intersection_params_vector = []
         inters = spline1.intersectCC(spline2)
         # GeomAPI_ExtremaCurveCurve intersectionObj(spline1, spline2);
@@ -433,32 +546,23 @@ class BSplineAlgorithms(object):
                 debug("Curves do not intersect each other")
         # for closed B-splines:
         if len(inters) == 1:
-            if spline1.isClosed():
-                if abs(param1 - spline1.getKnot(1)) < self.tol:
-                    # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the end of the closed curve, so add it by hand
-                    intersection_params_vector.append([spline1.getKnot(spline1.NbKnots), param2])
-                if abs(param1 - spline1.getKnot(spline1.NbKnots)) < self.tol:
-                    # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the beginning of the closed curve, so add it by hand
-                    intersection_params_vector.append([spline1.getKnot(1), param2])
-            elif spline2.isClosed():
-                if abs(param2 - spline2.getKnot(1)) < self.tol:
-                    # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the end of the closed curve, so add it by hand
-                    intersection_params_vector.append([param1, spline2.getKnot(spline2.NbKnots)])
-                if abs(param2 - spline2.getKnot(spline2.NbKnots)) < self.tol:
-                    # GeomAPI_ExtremaCurveCurve doesn't find second intersection point at the beginning of the closed curve, so add it by hand
-                    intersection_params_vector.append([param1, spline2.getKnot(1)])
+            intersection_params_vector.extend(self.closedIntersections(spline1, spline2, param1, param2))
 
         if len(inters) == 0:
             debug("intersectCC failed !")
-            e1 = spline1.toShape()
-            e2 = spline2.toShape()
-            d, pts, info = e1.distToShape(e2)
-            if d > tol3d * splines_scale:
-                debug("distToShape over tolerance ! %f > %f" % (d, tol3d * splines_scale))
-            p1, p2 = pts[0]
-            intersection_params_vector.append([spline1.parameter(p1), spline2.parameter(p2)])
+            intersection_params_vector.append(self.closestParameters(spline1, spline2, tol3d * splines_scale))
         return intersection_params_vector
 
+    def closestParameters(self, spline1, spline2, tol3d=0.0):
+        """Returns the parameters [param1, param2] of the closest points of spline1 and spline2"""
+        e1 = spline1.toShape()
+        e2 = spline2.toShape()
+        d, pts, info = e1.distToShape(e2)
+        if d > tol3d:
+            debug("distToShape over tolerance ! %f > %f" % (d, tol3d))
+        p1, p2 = pts[0]
+        return [spline1.parameter(p1), spline2.parameter(p2)]
+
     def curvesToSurface(self, curves, vParameters, continuousIfClosed):
         """Returns a surface that skins the list of curves"""
         # check amount of given parameters
@@ -11,6 +11,13 @@ import FreeCAD
 import Part
 import numpy as np
 from freecad.Curves import nurbs_tools
+try:
+    from scipy.linalg import cholesky_banded, cho_solve_banded
+    from scipy.sparse import bmat, csc_matrix, csr_matrix
+    from scipy.sparse.linalg import splu
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
 #  from math import pi
 
 DEBUG = False
@@ -76,51 +83,35 @@ def insertKnot(knot, count, degree, knots, mults, tol=1e-5):
         mults[pos] = min(mults[pos] + count, degree)
 
 
-def bsplineBasisMat(degree, knots, params, derivOrder):
-    """Return a matrix of values of BSpline Basis functions(or derivatives)"""
+def bsplineBasisMat(degree, knots, params, derivOrder, sparse=False):
+    """Return a matrix of values of BSpline Basis functions(or derivatives)
+    The matrix is assembled in a single vectorized pass.
+    If sparse is True, a scipy.sparse CSR matrix is returned,
+    that only stores the (degree + 1) nonzero values of each row"""
     ncp = len(knots) - degree - 1
-    mx = np.array([[0.] * ncp for i in range(len(params))])
-    # math_Matrix mx(1, params.Length(), 1, ncp);
-    # mx.Init(0.);
-    bspl_basis = np.array([[0.] * (ncp) for i in range(derivOrder + 1)])
-    # math_Matrix bspl_basis(1, derivOrder + 1, 1, degree + 1);
-    # bspl_basis.Init(0.);
-    # debug("params %s"%str(params))
-    for iparm in range(len(params)):  # for (Standard_Integer iparm = 1; iparm <= params.Length(); ++iparm) {
-        basis_start_index = 0
-
-        bb = nurbs_tools.BsplineBasis()
-        bb.knots = knots
-        bb.degree = degree
-        # span = bb.find_span(params[iparm])
-        # res = bb.ders_basis_funs( span, params[iparm], derivOrder)
-        for irow in range(derivOrder + 1):
-            # debug("irow %s"%str(irow))
-            # debug("bspl_basis[irow] %s"%str(bspl_basis[irow]))
-            bspl_basis[irow] = bb.evaluate(params[iparm], d=irow)
-            # debug("bspl_basis[irow] %s"%str(bspl_basis[irow]))
-            # for ival in range(len(res[irow])):
-                # bspl_basis[irow][ival+span] = res[irow][ival]
-        # # if OCC_VERSION_HEX >= VERSION_HEX_CODE(7,1,0)
-                # BSplCLib::EvalBsplineBasis(derivOrder, degree + 1, knots, params.Value(iparm), basis_start_index, bspl_basis);
-        # # else
-                # BSplCLib::EvalBsplineBasis(1, derivOrder, degree + 1, knots, params.Value(iparm), basis_start_index, bspl_basis);
-        # # endif
-        # if(derivOrder > 0):
-            # help_vector = np.array([0.]*ncp) # (1, ncp);
-            # # # help_vector.Init(0.);
-            # # help_vector.Set(basis_start_index, basis_start_index + degree, bspl_basis.Row(derivOrder + 1));
-            # mx[iparm] = bspl_basis[derivOrder] # mx.SetRow(iparm, help_vector);
-        # else:
-            # mx[iparm] = bspl_basis[derivOrder] #   mx.Set(iparm, iparm, basis_start_index, basis_start_index + degree, bspl_basis);
-        for i in range(len(bspl_basis[derivOrder])):
-            mx[iparm][basis_start_index + i] = bspl_basis[derivOrder][i]
+    nparams = len(params)
+    bb = nurbs_tools.BsplineBasis()
+    bb.knots = knots
+    bb.degree = degree
+    spans, values = bb.evaluate_array(params, derivOrder)
+    rows = np.repeat(np.arange(nparams), degree + 1)
+    cols = (spans[:, None] - degree + np.arange(degree + 1)).ravel()
+    if sparse:
+        if not SCIPY_AVAILABLE:
+            raise RuntimeError("Sparse basis matrix requires scipy")
+        return csr_matrix((values.ravel(), (rows, cols)), shape=(nparams, ncp))
+    mx = np.zeros((nparams, ncp))
+    mx[rows, cols] = values.ravel()
     return mx
 
 
 class BSplineApproxInterp(object):
     """BSpline curve approximating a list of points
-    Some points can be interpolated, or be set as C0 kinks"""
+    Some points can be interpolated, or be set as C0 kinks
+    solver attribute selects the linear solver :
+    - "dense" : numpy dense solver
+    - "sparse" : banded Cholesky, or sparse LU if there are constraints (requires scipy)
+    - "auto" : sparse if scipy is available, dense otherwise"""
     #  used in BSplineAlgorithms.reparametrizeBSplineContinuouslyApprox
 
     def __init__(self, points, nControlPoints, degree, continuous_if_closed):
@@ -131,6 +122,9 @@ class BSplineApproxInterp(object):
         self.C2Continuous = continuous_if_closed
         self.indexOfInterpolated = list()
         self.indexOfKinks = list()
+        self.solver = "auto"
+        #  per iteration telemetry of FitCurveOptimal
+        self.convergence = []
 
     def InterpolatePoint(self, pointIndex, withKink):
         """Switch point from approximation to interpolation
@@ -161,22 +155,25 @@ class BSplineApproxInterp(object):
 
         # solve system
         iteration = 0
+        self.convergence = []
         result, error = self.python_solve(parms, knots, mults)  # TODO occKnots, occMults ???? See above
         if error is None:
             return None, None
         old_error = error * 2
+        self.convergence.append({"iteration": iteration, "error": error, "newton_iterations": 0, "max_step": 0.})
 
         debug("FitCurveOptimal iteration # {}".format(iteration))
         debug("error = {}".format(error))
         while ((error > 0) and ((old_error - error) / max(error, 1e-6) > 1e-6) and (iteration < maxIter)):
             debug("FitCurveOptimal iteration # {}".format(iteration))
             old_error = error
-            self.optimizeParameters(result, parms)
+            nb_newton, max_step = self.optimizeParameters(result, parms)
             result, error = self.python_solve(parms, knots, mults)
             if error is None:
                 return None, None
-            debug("error = {}".format(error))
             iteration += 1
+            self.convergence.append({"iteration": iteration, "error": error, "newton_iterations": nb_newton, "max_step": max_step})
+            debug("error = {}".format(error))
         return result, error
 
     def computeParameters(self, alpha):
@@ -298,19 +295,7 @@ class BSplineApproxInterp(object):
         Returns the curve, and the max error between points and curve
         This method is used by iterative function FitCurveOptimal"""
 
-        # debug("python_solve(params, knots, mults):\n%s\n%s\n%s"%(params, knots, mults))
-
-        #  TODO knots and mults are OCC arrays (1-based)
-        #  TODO I replaced the following OCC objects with numpy arrays:
-        # math_Matrix (Init, Set, Transposed, Multiplied, )
-        # math_Gauss (Solve, IsDone)
-        # math_Vector (Set)
         #  compute flat knots to solve system
-
-        #  TODO check code below !!!
-        # nFlatKnots = BSplCLib::KnotSequenceLength(mults, self.degree, False)
-        # TColStd_Array1OfReal flatKnots(1, nFlatKnots)
-        # BSplCLib::KnotSequence(knots, mults, flatKnots)
         flatKnots = []
         for i in range(len(knots)):
             flatKnots += [knots[i]] * mults[i]
@@ -318,7 +303,8 @@ class BSplineApproxInterp(object):
         n_apprxmated = len(self.indexOfApproximated)
         n_intpolated = len(self.indexOfInterpolated)
         n_continuityConditions = 0
-        if self.isClosed():
+        closed = self.isClosed()
+        if closed:
             #  C0, C1, C2
             n_continuityConditions = 3
             if self.firstAndLastInterpolated():
@@ -333,136 +319,48 @@ class BSplineApproxInterp(object):
         if (n_apprxmated == 0 and not nCtrPnts == (n_intpolated + n_continuityConditions)):
             raise RuntimeError("Wrong number of control points for curve interpolation!")
 
-        #  Build left hand side of the equation
-        n_vars = nCtrPnts + n_intpolated + n_continuityConditions
-        lhs = np.array([[0.] * (n_vars) for i in range(n_vars)])
-        # math_Matrix lhs(1, n_vars, 1, n_vars)
-        # lhs.Init(0.)
-
-        #  Allocate right hand side
-        rhsx = np.array([0.] * n_vars)
-        rhsy = np.array([0.] * n_vars)
-        rhsz = np.array([0.] * n_vars)
-        # debug(n_apprxmated)
+        if self.solver == "auto":
+            use_sparse = SCIPY_AVAILABLE
+        elif self.solver == "sparse":
+            if not SCIPY_AVAILABLE:
+                raise RuntimeError("Sparse solver requires scipy")
+            use_sparse = True
+        else:
+            use_sparse = False
+
+        pts = np.array([[p.x, p.y, p.z] for p in self.pnts])
+        params = np.asarray(params, dtype=float)
+
+        #  Solve constrained linear least squares
+        #  min(Ax - b) s.t. Cx = d
+        #  A : the points to be approximated
+        A = None
+        b = None
         if (n_apprxmated > 0):
-            #  Write b vector. These are the points to be approximated
-            appParams = np.array([0.] * n_apprxmated)
-            bx = np.array([0.] * n_apprxmated)
-            by = np.array([0.] * n_apprxmated)
-            bz = np.array([0.] * n_apprxmated)
-            # appIndex = 0
-            for idx in range(len(self.indexOfApproximated)):
-                ioa = self.indexOfApproximated[idx]  # + 1
-                p = self.pnts[ioa]
-                bx[idx] = p.x
-                by[idx] = p.y
-                bz[idx] = p.z
-                appParams[idx] = params[ioa]
-                # debug(appParams[idx])
-                # appIndex += 1
-
-            #  Solve constrained linear least squares
-            #  min(Ax - b) s.t. Cx = d
-            #  Create left hand side block matrix
-            #  A.T*A  C.T
-            #  C      0
-            # math_Matrix A = CTiglBSplineAlgorithms::bsplineBasisMat(m_degree, flatKnots, appParams)
-            # math_Matrix At = A.Transposed()
-
-            # bsa = BSplineAlgorithms(1e-6)
-            A = bsplineBasisMat(self.degree, flatKnots, appParams, 0)
-            # debug("self.degree %s"%str(self.degree))
-            # debug("flatKnots %s"%str(flatKnots))
-            # debug("appParams %s"%str(appParams))
-            At = A.T
-            mul = np.matmul(At, A)
-            # debug(lhs)
-            # debug(mul)
-            for i in range(len(mul)):
-                for j in range(len(mul)):
-                    lhs[i][j] = mul[i][j]
-            # debug("mul : %s"%str(mul.shape))
-            # debug("rhsx : %s"%(rhsx.shape))
-            # debug("np.matmul(At,bx) : %s"%(np.matmul(At,bx).shape))
-            le = len(np.matmul(At, bx))
-            rhsx[0:le] = np.matmul(At, bx)
-            rhsy[0:le] = np.matmul(At, by)
-            rhsz[0:le] = np.matmul(At, bz)
-        # debug("lhs : %s"%str(lhs))
+            b = pts[self.indexOfApproximated]
+            appParams = params[self.indexOfApproximated]
+            A = bsplineBasisMat(self.degree, flatKnots, appParams, 0, sparse=use_sparse)
+
+        #  C : the points that should be interpolated
+        #  as well as the continuity constraints for closed curve
+        C = None
+        d = np.zeros((n_intpolated + n_continuityConditions, 3))
         if (n_intpolated + n_continuityConditions > 0):
-            #  Write d vector. These are the points that should be interpolated as well as the continuity constraints for closed curve
-            # math_Vector dx(1, n_intpolated + n_continuityConditions, 0.)
-            dx = np.array([0.] * (n_intpolated + n_continuityConditions))
-            dy = np.array([0.] * (n_intpolated + n_continuityConditions))
-            dz = np.array([0.] * (n_intpolated + n_continuityConditions))
+            blocks = []
             if (n_intpolated > 0):
-                interpParams = [0] * n_intpolated
-                # intpIndex = 0
-                # for (std::vector<size_t>::const_iterator it_idx = m_indexOfInterpolated.begin() it_idx != m_indexOfInterpolated.end() ++it_idx) {
-                    # Standard_Integer ipnt = static_cast<Standard_Integer>(*it_idx + 1)
-                for idx in range(len(self.indexOfInterpolated)):
-                    ioi = self.indexOfInterpolated[idx]  # + 1
-                    p = self.pnts[ioi]
-                    dx[idx] = p.x
-                    dy[idx] = p.y
-                    dz[idx] = p.z
-                    try:
-                        interpParams[idx] = params[ioi]
-                    except IndexError:
-                        debug(ioi)
-                    # intpIndex += 1
-
-                C = bsplineBasisMat(self.degree, flatKnots, interpParams, 0)
-                Ct = C.T
-                # debug("C : %s"%str(C.shape))
-                # debug("Ct : %s"%str(Ct.shape))
-                # debug("lhs : %s"%str(lhs.shape))
-                for i in range(nCtrPnts):
-                    for j in range(n_intpolated):
-                        lhs[i][j + nCtrPnts] = Ct[i][j]
-                        lhs[j + nCtrPnts][i] = C[j][i]
-                # lhs.Set(1, nCtrPnts, nCtrPnts + 1, nCtrPnts + n_intpolated, Ct)
-                # lhs.Set(nCtrPnts + 1,  nCtrPnts + n_intpolated, 1, nCtrPnts, C)
-                # debug("lhs : %s"%str(lhs.shape))
-
-            #  sets the C2 continuity constraints for closed curves on the left hand side if requested
-            if self.isClosed():
-                continuity_entries = self.getContinuityMatrix(nCtrPnts, n_continuityConditions, params, flatKnots)
-                continuity_entriest = continuity_entries.T
-                debug("continuity_entries : {}".format(str(continuity_entries.shape)))
-                for i in range(n_continuityConditions):
-                    for j in range(nCtrPnts):
-                        lhs[nCtrPnts + n_intpolated + i][j] = continuity_entries[i][j]
-                        lhs[j][nCtrPnts + n_intpolated + i] = continuity_entriest[j][i]
-                # lhs.Set(nCtrPnts + n_intpolated + 1, nCtrPnts + n_intpolated + n_continuityConditions, 1, nCtrPnts, continuity_entries)
-                # lhs.Set(1, nCtrPnts, nCtrPnts + n_intpolated + 1, nCtrPnts + n_intpolated + n_continuityConditions, continuity_entries.Transposed())
-
-            rhsx[nCtrPnts:n_vars + 1] = dx
-            rhsy[nCtrPnts:n_vars + 1] = dy
-            rhsz[nCtrPnts:n_vars + 1] = dz
-            # rhsy.Set(nCtrPnts + 1, n_vars, dy)
-            # rhsz.Set(nCtrPnts + 1, n_vars, dz)
-
-        # math_Gauss solver(lhs)
-
-        # math_Vector cp_x(1, n_vars)
-        # math_Vector cp_y(1, n_vars)
-        # math_Vector cp_z(1, n_vars)
-
-        # solver.Solve(rhsx, cp_x)
-        # if (!solver.IsDone()) {
-            # raise RuntimeError("Singular Matrix")
-        # }
-        # debug("lhs : %s"%str(lhs))
-        # debug("rhsx : %s"%str(rhsx))
+                d[:n_intpolated] = pts[self.indexOfInterpolated]
+                interpParams = params[self.indexOfInterpolated]
+                blocks.append(bsplineBasisMat(self.degree, flatKnots, interpParams, 0))
+            if closed:
+                blocks.append(self.getContinuityMatrix(nCtrPnts, n_continuityConditions, params, flatKnots))
+            C = np.vstack(blocks)
+
         try:
-            cp_x = np.linalg.solve(lhs, rhsx)
-            cp_y = np.linalg.solve(lhs, rhsy)
-            cp_z = np.linalg.solve(lhs, rhsz)
-        except np.linalg.LinAlgError:
-            debug("Numpy linalg solver failed\n")
+            cp = self.solve_system(A, b, C, d, nCtrPnts, use_sparse)
+        except (np.linalg.LinAlgError, RuntimeError):
+            debug("Linear solver failed\n")
             return None, None
-        poles = [FreeCAD.Vector(cp_x[i], cp_y[i], cp_z[i]) for i in range(nCtrPnts)]
+        poles = [FreeCAD.Vector(*cp[i]) for i in range(nCtrPnts)]
 
         result = Part.BSplineCurve()
         debug("{} poles : {}".format(len(poles), poles))
@@ -474,26 +372,91 @@ class BSplineApproxInterp(object):
 
         #  compute error
         max_error = 0.
-        for idx in range(len(self.indexOfApproximated)):
-            ioa = self.indexOfApproximated[idx]
-            p = self.pnts[ioa]
-            par = params[ioa]
-            error = result.value(par).distanceToPoint(p)
-            max_error = max(max_error, error)
+        if (n_apprxmated > 0):
+            errors = np.linalg.norm(A @ cp[:nCtrPnts] - b, axis=1)
+            max_error = float(np.max(errors))
         return result, max_error
 
+    def factorize(self, A, C, nCtrPnts, use_sparse):
+        """Factorize the system matrix of the constrained least squares problem
+        Without constraints, the banded normal equations A.T*A are solved by Cholesky.
+        Otherwise, the KKT block matrix is factorized by (sparse) LU :
+        A.T*A  C.T
+        C      0
+        Returns a (method, factor) tuple.
+        The dense matrix is returned as is, and solved by numpy"""
+        n_cons = 0 if C is None else len(C)
+        if not use_sparse:
+            n_vars = nCtrPnts + n_cons
+            lhs = np.zeros((n_vars, n_vars))
+            if A is not None:
+                lhs[:nCtrPnts, :nCtrPnts] = A.T @ A
+            if n_cons > 0:
+                lhs[nCtrPnts:, :nCtrPnts] = C
+                lhs[:nCtrPnts, nCtrPnts:] = C.T
+            return "dense", lhs
+
+        if A is not None:
+            N = (A.T @ A).tocsc()
+        else:
+            N = csc_matrix((nCtrPnts, nCtrPnts))
+        if n_cons == 0:
+            #  A.T*A is symmetric with bandwidth = degree
+            coo = N.tocoo()
+            upper = coo.row <= coo.col
+            ab = np.zeros((self.degree + 1, nCtrPnts))
+            ab[self.degree + coo.row[upper] - coo.col[upper], coo.col[upper]] = coo.data[upper]
+            try:
+                return "banded", cholesky_banded(ab)
+            except np.linalg.LinAlgError:
+                debug("Normal equations are not positive definite, using LU\n")
+            return "lu", splu(N)
+        Cs = csr_matrix(C)
+        kkt = bmat([[N, Cs.T], [Cs, None]], format="csc")
+        return "lu", splu(kkt)
+
+    def solve_system(self, A, b, C, d, nCtrPnts, use_sparse=False):
+        """Solve the constrained linear least squares problem
+        min(Ax - b) s.t. Cx = d
+        for the 3 coordinates at once.
+        Returns an array of shape (nCtrPnts + len(C), 3)"""
+        n_cons = 0 if C is None else len(C)
+        rhs = np.zeros((nCtrPnts + n_cons, 3))
+        if A is not None:
+            rhs[:nCtrPnts] = A.T @ b
+        if n_cons > 0:
+            rhs[nCtrPnts:] = d
+
+        method, factor = self.factorize(A, C, nCtrPnts, use_sparse)
+
+        if method == "banded":
+            return cho_solve_banded((factor, False), rhs)
+        elif method == "lu":
+            return factor.solve(rhs)
+        return np.linalg.solve(factor, rhs)
+
     def optimizeParameters(self, curve, params):
-        # /**
-        # * @brief Recalculates the curve parameters t_k after the
-        # * control points are fitted to achieve an even better fit.
-        # */
-        #  optimize each parameter by finding it's position on the curve
-        #  for (std::vector<size_t>::const_iterator it_idx = m_indexOfApproximated.begin(); it_idx != m_indexOfApproximated.end(); ++it_idx) {
-        for i in self.indexOfApproximated:  # range(len(self.indexOfApproximated)):
-            # parameter, error = self.projectOnCurve(self.pnts[i], curve, params[i])
-            # debug("optimize Parameter %d from %0.4f to %0.4f"%(i,params[i],parameter))
-            #  store optimised parameter
-            params[i] = curve.parameter(self.pnts[i])  # parameter
+        """Recalculates the curve parameters t_k after the
+        control points are fitted to achieve an even better fit.
+        All the approximated points are projected on the curve at once,
+        except the seam points of a closed curve, whose start and end points coincide.
+        They keep their parameter, so that they can't jump to the other end of the curve,
+        which would make the continuity constraints singular.
+        Returns the number of Newton iterations and the max parameter step"""
+        seam = set()
+        if self.isClosed():
+            seam = {0, len(self.pnts) - 1}
+        indices = [i for i in self.indexOfApproximated if i not in seam]
+        if len(indices) == 0:
+            return 0, 0.
+        poles = np.array([[p.x, p.y, p.z] for p in curve.getPoles()])
+        pnts = np.array([[self.pnts[i].x, self.pnts[i].y, self.pnts[i].z] for i in indices])
+        initialParms = [params[i] for i in indices]
+        new_params, nb_iter, max_step = nurbs_tools.project_on_bspline(self.degree, curve.KnotSequence, poles, pnts, initialParms)
+        #  store optimised parameters
+        for i, par in zip(indices, new_params):
+            params[i] = float(par)
+        return nb_iter, max_step
 
     def projectOnCurve(self, pnt, curve, inital_Parm):
         maxIter = 10  # maximum No of iterations
@@ -9,8 +9,10 @@ import os
 import FreeCAD
 import FreeCADGui
 import Part
+import numpy as np
 # from freecad.Curves import _utils
 from freecad.Curves import ICONPATH
+from freecad.Curves.nurbs_tools import bspline_derivatives
 from FreeCAD import Base
 from pivy import coin
 
@@ -75,29 +77,85 @@ def getEdgePointCurvNormList(edge, paramList):
     return [pts, cur, nor]
 
 
+def getEdgeDerivatives(edge, paramList):
+    """Returns the arrays of points, first and second derivatives of edge at the parameters.
+    Non-rational BSpline curves are evaluated in a single vectorized pass,
+    other curves with one getD2 call per parameter"""
+    if isinstance(edge, isoEdge):
+        edge = edge.edge3d
+    params = np.asarray(paramList, dtype=float)
+    curve = edge.Curve
+    if isinstance(curve, Part.BSplineCurve) and not curve.isRational():
+        if curve.isPeriodic():
+            # the comb may be outside the base period, map the parameters into it
+            first = curve.FirstParameter
+            params = first + np.mod(params - first, curve.getPeriod())
+            curve = curve.copy()
+            curve.setNotPeriodic()
+        ders = bspline_derivatives(curve.Degree, curve.KnotSequence, curve.getPoles(), params, 2)
+    else:
+        ders = np.array([curve.getD2(p) for p in params], dtype=float).reshape(-1, 3, 3)
+    return ders[:, 0], ders[:, 1], ders[:, 2]
+
+
+def getCurvatureNormals(d1, d2):
+    """Returns the curvatures and the unit normals, computed from the derivatives arrays.
+    The normal is a null vector where curvature is null"""
+    cross = np.cross(d1, d2)
+    speed = np.linalg.norm(d1, axis=1)
+    cn = np.linalg.norm(cross, axis=1)
+    cur = np.zeros(len(d1))
+    valid = speed > 1e-12
+    cur[valid] = cn[valid] / speed[valid] ** 3
+    nor = np.cross(cross, d1)
+    nn = np.linalg.norm(nor, axis=1)
+    valid = nn > 1e-12 * np.maximum(1.0, speed ** 3)
+    nor[valid] /= nn[valid, None]
+    nor[~valid] = 0.0
+    return cur, nor
+
+
+def getAdaptiveParamList(edge, num=64, oversampling=4):
+    """Returns a list of num parameters of edge,
+    with a spacing that decreases where curvature is high"""
+    fine = np.array(getEdgeParamList(edge, None, None, oversampling * num))
+    pts, d1, d2 = getEdgeDerivatives(edge, fine)
+    cur, nor = getCurvatureNormals(d1, d2)
+    weight = np.linalg.norm(d1, axis=1) * (1.0 + edge.Length * cur)
+    cumul = np.concatenate([[0.0], np.cumsum(0.5 * (weight[1:] + weight[:-1]) * np.diff(fine))])
+    if cumul[-1] <= 0.0:
+        return fine[::oversampling].tolist()
+    return np.interp(np.linspace(0.0, cumul[-1], max(2, num)), cumul, fine).tolist()
+
+
 def getEdgeData(edge, paramList):
-    pts = getEdgePointList(edge, paramList)
-    cur = getEdgeCurvatureList(edge, paramList)
-    nor = getEdgeNormalList(edge, paramList)
+    """Returns the arrays of points, curvatures and normals of edge at the parameters,
+    computed in a single pass"""
+    pts, d1, d2 = getEdgeDerivatives(edge, paramList)
+    cur, nor = getCurvatureNormals(d1, d2)
+    if isinstance(edge, isoEdge):
+        nor = np.array(getEdgeNormalList(edge, paramList), dtype=float)
     return [pts, cur, nor]
 
 
+def getEdgeKey(edge, num=9):
+    """Returns a hashable key of the edge geometry,
+    made of its parameter range, its length and some sample points"""
+    params = getEdgeParamList(edge, None, None, num)
+    pts = np.array([edge.valueAt(p) for p in params], dtype=float).round(9)
+    return (type(edge).__name__, round(edge.FirstParameter, 9), round(edge.LastParameter, 9),
+            round(edge.Length, 9), pts.tobytes())
+
+
 def getCombPoints(data, scale):
-    pts = []
-    for i in range(len(data[0])):
-        v = FreeCAD.Vector(data[2][i]).multiply(data[1][i] * scale)
-        pts.append(data[0][i].add(v))
-    return pts
+    pts = np.asarray(data[0]) + np.asarray(data[2]) * (np.asarray(data[1]) * scale)[:, None]
+    return [FreeCAD.Vector(*p) for p in pts.tolist()]
 
 
 def getSoPoints(data, scale):
-    pts = []
-    for i in range(len(data[0])):
-        v = FreeCAD.Vector(data[2][i]).multiply(data[1][i] * scale)
-        w = data[0][i].add(v.negative())
-        pts.append((data[0][i].x, data[0][i].y, data[0][i].z))
-        pts.append((w.x, w.y, w.z))
-    return pts
+    pts = np.asarray(data[0])
+    tips = pts - np.asarray(data[2]) * (np.asarray(data[1]) * scale)[:, None]
+    return [tuple(p) for p in np.stack((pts, tips), axis=1).reshape(-1, 3).tolist()]
 
 
 def getCombCoords(fp):
@@ -143,6 +201,12 @@ class isoEdge:
     def valueAt(self, p):
         return self.edge3d.valueAt(p)
 
+    def derivative1At(self, p):
+        return self.edge3d.derivative1At(p)
+
+    def derivative2At(self, p):
+        return self.edge3d.derivative2At(p)
+
     def normalAt(self, p):
         p3d = self.valueAt(p)
         p2d = self.surf.parameter(p3d)
@@ -188,10 +252,14 @@ class Comb:
                         "Comb", "CombPoints")
         obj.addProperty("Part::PropertyPartShape", "Shape",
                         "Comb", "Shape of comb plot")
+        obj.addProperty("App::PropertyBool", "Adaptive",
+                        "Comb", "Curvature driven sample spacing").Adaptive = False
         obj.Proxy = self
         # obj.Samples = (20,2,1000,10)
         obj.CombPoints = []
         self.edges = []
+        self.data = []
+        self.cache = dict()
         self.TotalLength = 0.0
         self.factor = 1.0
         # self.selectedEdgesToProperty( obj, edge)
@@ -314,14 +382,31 @@ class Comb:
         debug(str(res))
         return res
 
+    def sampleEdges(self, obj):
+        """Compute the points, curvatures and normals of all the edges.
+        The samples are cached by edge geometry and sampling settings,
+        so that only new or modified edges are sampled again"""
+        adaptive = getattr(obj, "Adaptive", False)
+        old_cache = getattr(self, "cache", None) or dict()
+        self.cache = dict()
+        self.data = []
+        for e in self.edges:
+            key = (getEdgeKey(e), obj.Samples, adaptive)
+            data = old_cache.get(key) or self.cache.get(key)
+            if data is None:
+                if adaptive:
+                    pl = getAdaptiveParamList(e, obj.Samples)
+                else:
+                    pl = getEdgeParamList(e, None, None, obj.Samples)
+                data = getEdgeData(e, pl)
+            self.cache[key] = data
+            self.data.append(data)
+
     def getMaxCurv(self, obj):
         self.maxCurv = 0.001
-        for e in self.edges:
-            pl = getEdgeParamList(e, None, None, obj.Samples)
-            cl = getEdgeCurvatureList(e, pl)
-            m = max(cl)
-            if self.maxCurv < m:
-                self.maxCurv = m
+        for data in self.data:
+            if len(data[1]):
+                self.maxCurv = max(self.maxCurv, float(np.max(data[1])))
         debug("max curvature : {}".format(str(self.maxCurv)))
 
     def getCurvFactor(self, obj):
@@ -337,11 +422,8 @@ class Comb:
         debug("Curvature Factor : {}".format(str(self.factor)))
 
     def buildPoints(self, obj):
-        obj.CombPoints = []
         pts = []
-        for e in self.edges:
-            pl = getEdgeParamList(e, None, None, obj.Samples)
-            data = getEdgeData(e, pl)
+        for data in self.data:
             pts += getSoPoints(data, self.factor)
         obj.CombPoints = pts
         debug(str(len(obj.CombPoints)) + " Comb points")   # +str(obj.CombPoints)+"")
@@ -351,6 +433,7 @@ class Comb:
         # self.selectedEdgesToProperty( obj, edge)
         self.setEdgeList(obj)
         self.computeTotalLength(obj)
+        self.sampleEdges(obj)
         self.getMaxCurv(obj)
         self.getCurvFactor(obj)
         self.buildPoints(obj)
@@ -369,12 +452,19 @@ class Comb:
                 self.factor = 0.5 * self.TotalLength / self.maxCurv
                 fp.Scale = self.factor
             debug("Comb : Scale Property changed to " + str(fp.Scale))
-            self.execute(fp)
+            if getattr(self, "data", None):
+                # display only change : rescale the cached samples
+                self.getCurvFactor(fp)
+                self.buildPoints(fp)
+            else:
+                self.execute(fp)
         if prop == "Samples":
             if fp.Samples < 10:
                 fp.Samples = 10
             debug("Comb : Samples Property changed")
             self.execute(fp)
+        if prop == "Adaptive":
+            self.execute(fp)
 
     if FreeCAD.Version()[0] == '0' and '.'.join(FreeCAD.Version()[1:3]) >= '21.2':
         def dumps(self):
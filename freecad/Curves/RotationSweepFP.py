@@ -40,12 +40,20 @@ class RotsweepProxyFP:
                         "Settings", "Add profiles to the sweep shape")
         obj.addProperty("App::PropertyInteger", "ExtraProfiles",
                         "ExtraProfiles", "Number of extra profiles")
+        obj.addProperty("App::PropertyInteger", "FrameSamples",
+                        "ExtraProfiles", "Number of path frames interpolated by the extra profiles (0 = exact frames)").FrameSamples = 0
         obj.addProperty("App::PropertyBool", "SmoothTop",
                         "Settings", "Build a smooth top with extra profiles")
         obj.setEditorMode("ViewProfiles", 2)
         # obj.setEditorMode("ExtraProfiles", 2)
         obj.Proxy = self
 
+    def onDocumentRestored(self, obj):
+        if not hasattr(obj, "FrameSamples"):
+            # exact frames, to keep the shape of older documents
+            obj.addProperty("App::PropertyInteger", "FrameSamples",
+                            "ExtraProfiles", "Number of path frames interpolated by the extra profiles (0 = exact frames)").FrameSamples = 0
+
     def getCurve(self, lo):
         edges = []
         po, psn = lo
@@ -106,6 +114,7 @@ class RotsweepProxyFP:
             inter = SweepPath.SweepAroundInterpolator(rs)
             inter.Extend = (not obj.TrimPath) or (len(profiles) < 2)
             inter.NumExtra = obj.ExtraProfiles
+            inter.FrameSamples = max(0, getattr(obj, "FrameSamples", 0))
             if obj.SmoothTop:
                 inter.setSmoothTop()
             if obj.FaceSupport is not None:
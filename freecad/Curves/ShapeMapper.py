@@ -5,6 +5,11 @@ import FreeCADGui
 import Part
 import functools
 import time
+from itertools import product
+
+import numpy as np
+
+from freecad.Curves.lib.profiler import tracer
 
 
 mes = FreeCAD.Console.PrintMessage
@@ -14,7 +19,8 @@ def timer(func):
     @functools.wraps(func)
     def wrapper_timer(*args, **kwargs):
         tic = time.perf_counter()
-        value = func(*args, **kwargs)
+        with tracer.span(func.__qualname__):
+            value = func(*args, **kwargs)
         toc = time.perf_counter()
         elapsed_time = toc - tic
         mes(f"{func.__name__} took {elapsed_time:0.4f} seconds")
@@ -186,32 +192,65 @@ def contact(pc1, pc2, tol=1e-7):
     return False
 
 
+def end_points(pcurves):
+    "return the (n, 2, 3) array of the end points of a list of pcurves"
+    pts = []
+    for c, fp, lp in pcurves:
+        for v in (c.value(fp), c.value(lp)):
+            pts.append((v.x, v.y, getattr(v, "z", 0.0)))
+    return np.array(pts, dtype=float).reshape(-1, 2, 3)
+
+
 # @timer
 def find_joined_pcurves(pcurves, tol=1e-7):
     """Sort a list of pcurves
-    and return a list of lists of joined pcurves
+    and return a list of lists of joined pcurves.
+    tol is the square distance tolerance of contact().
+    End points are evaluated once, and hashed in a grid
+    whose cell size is the contact distance
     """
+    nb = len(pcurves)
+    if nb == 0:
+        return [[0]]
+    ends = end_points(pcurves)
+    size = max(tol, 1e-300) ** 0.5
+    cells = np.floor(ends / size).astype(np.int64)
+    grid = dict()
+    for idx in range(nb):
+        for key in set(map(tuple, cells[idx])):
+            grid.setdefault(key, []).append(idx)
+    available = np.ones(nb, dtype=bool)
+    available[0] = False
+    nb_remain = nb - 1
+    first_remain = 1
+
+    def next_contact(i):
+        "return the lowest available index in contact with pcurve i, or None"
+        found = None
+        for cell in cells[i]:
+            for offset in product((-1, 0, 1), repeat=3):
+                for idx in grid.get(tuple(cell + offset), ()):
+                    if available[idx] and (found is None or idx < found):
+                        d = ends[i][:, None, :] - ends[idx][None, :, :]
+                        if ((d * d).sum(axis=2) < tol).any():
+                            found = idx
+        return found
+
     joined = []
     curr = [0]
-    remain = list(range(1, len(pcurves)))
-    while len(remain) > 0:
-        # print(f"--- Search pass for {curr}")
-        # print(remain)
-        found = False
-        for idx in remain:
-            if contact(pcurves[curr[-1]], pcurves[idx]):
-                curr.append(idx)
-                remain.remove(idx)
-                found = True
-                # print(f"Found {idx}")
-                break
-        if not found:
+    while nb_remain > 0:
+        idx = next_contact(curr[-1])
+        if idx is None:
             joined.append(curr)
-            curr = [remain[0]]
-            remain.pop(0)
-    # if len(curr) == 1:
+            while not available[first_remain]:
+                first_remain += 1
+            idx = first_remain
+            curr = [idx]
+        else:
+            curr.append(idx)
+        available[idx] = False
+        nb_remain -= 1
     joined.append(curr)
-    # print(joined)
     return joined
 
 
@@ -479,7 +518,8 @@ class ShapeMapper:
     def timer(func):
         def wrapper_timer(self, *args, **kwargs):
             tic = time.perf_counter()
-            value = func(self, *args, **kwargs)
+            with tracer.span(func.__qualname__):
+                value = func(self, *args, **kwargs)
             toc = time.perf_counter()
             elapsed_time = toc - tic
             self.Messages.append(f"{func.__name__}: {elapsed_time:0.4f} seconds")
@@ -2,7 +2,9 @@
 
 import FreeCAD
 import Part
+import numpy as np
 from freecad.Curves import curves_to_surface as CTS
+from freecad.Curves.nurbs_tools import BsplineBasis
 
 
 DEBUG = False
@@ -81,6 +83,20 @@ def contact_shapes(bscurve, shape1, shape2):
     contact_points(bscurve, pt1, pt2)
 
 
+def transform_poles(curve, matrix):
+    """transform_poles(bspline_curve, matrix)
+    Returns a copy of bspline_curve whose poles are
+    transformed by the 4x4 numpy matrix.
+    """
+    poles = np.array(curve.getPoles(), dtype=float)
+    poles = poles @ matrix[:3, :3].T + matrix[:3, 3]
+    bs = Part.BSplineCurve()
+    bs.buildFromPolesMultsKnots([FreeCAD.Vector(*p) for p in poles],
+                                curve.getMultiplicities(), curve.getKnots(),
+                                curve.isPeriodic(), curve.Degree, curve.getWeights())
+    return bs
+
+
 class BSplineFacade:
     """Class BSplineFacade is a collection of functions
     that work both on BSpline curves and BSpline surfaces.
@@ -485,9 +501,37 @@ class SweepInterpolator:
         self.Sweep = sweep
         self.Extend = extend
         self.NumExtra = extra
-        self.FaceSupport = None
         self.localLoft = None
         self.TopNormal = None
+        self._face_support = None
+        self._frame_samples = 0
+        self.clearFrames()
+
+    @property
+    def FrameSamples(self):
+        """Number of path stations of the frame table.
+        0 : frames are computed exactly at each parameter"""
+        return self._frame_samples
+
+    @FrameSamples.setter
+    def FrameSamples(self, nb):
+        if not nb == self._frame_samples:
+            self._frame_samples = nb
+            self.clearFrames()
+
+    @property
+    def FaceSupport(self):
+        return self._face_support
+
+    @FaceSupport.setter
+    def FaceSupport(self, face):
+        self._face_support = face
+        self.clearFrames()
+
+    def clearFrames(self):
+        "Clear the cached path frames"
+        self._frames = dict()
+        self._frame_table = None
 
     def valueAt(self, par):
         return self.Sweep.Path.valueAt(par)
@@ -506,18 +550,69 @@ class SweepInterpolator:
     def binormalAt(self, par):
         return self.normalAt(par).cross(self.tangentAt(par))
 
-    def transitionMatrixAt(self, par):
-        """Path local CS"""
+    def computeFrame(self, par):
+        """Path local CS, as a 4x4 numpy matrix"""
         poc = self.valueAt(par)
         bno = self.binormalAt(par)
         tan = self.tangentAt(par)
         nor = self.normalAt(par)
-        m = FreeCAD.Matrix(bno.x, tan.x, nor.x, poc.x,
-                           bno.y, tan.y, nor.y, poc.y,
-                           bno.z, tan.z, nor.z, poc.z,
-                           0, 0, 0, 1)
-        # print(m.analyze())
-        return m
+        return np.array([[bno.x, tan.x, nor.x, poc.x],
+                         [bno.y, tan.y, nor.y, poc.y],
+                         [bno.z, tan.z, nor.z, poc.z],
+                         [0, 0, 0, 1]], dtype=float)
+
+    def frameTable(self):
+        """Returns the parameters and the frames of the FrameSamples stations of the path"""
+        if self._frame_table is None:
+            u0, u1 = self.Sweep.Path.ParameterRange
+            params = np.linspace(u0, u1, max(2, self.FrameSamples))
+            self._frame_table = (params, np.array([self.computeFrame(p) for p in params]))
+        return self._frame_table
+
+    def interpolateFrames(self, params):
+        """Returns the array of the frames at params, interpolated in the frame table.
+        Each column is linearly interpolated. The tangent and normal axes are then
+        orthonormalized, and scaled by their interpolated lengths.
+        The binormal is kept as interpolated, since it is not always
+        perpendicular to the tangent (e.g. the binormal of SweepAround)"""
+        table_params, table = self.frameTable()
+        axes = np.empty((len(params), 3, 3))
+        for j in range(3):
+            for i in range(3):
+                axes[:, i, j] = np.interp(params, table_params, table[:, i, j])
+        lengths = [np.interp(params, table_params, np.linalg.norm(table[:, :3, j], axis=1)) for j in (1, 2)]
+        tan = axes[:, :, 1]
+        tan /= np.maximum(np.linalg.norm(tan, axis=1), 1e-50)[:, None]
+        nor = axes[:, :, 2] - np.einsum('ij,ij->i', axes[:, :, 2], tan)[:, None] * tan
+        nor /= np.maximum(np.linalg.norm(nor, axis=1), 1e-50)[:, None]
+        frames = np.zeros((len(params), 4, 4))
+        frames[:, :3, 0] = axes[:, :, 0]
+        frames[:, :3, 1] = tan * lengths[0][:, None]
+        frames[:, :3, 2] = nor * lengths[1][:, None]
+        frames[:, :3, 3] = [self.valueAt(p) for p in params]
+        frames[:, 3, 3] = 1.0
+        return frames
+
+    def framesAt(self, params):
+        """Returns the array of the path local CS (4x4 numpy matrices) at params.
+        If FrameSamples > 0, the frames are interpolated between the stations of
+        the frame table (see interpolateFrames). Otherwise, they are computed exactly,
+        and cached by parameter"""
+        params = [float(p) for p in params]
+        if self.FrameSamples > 0:
+            return self.interpolateFrames(params)
+        for p in params:
+            if p not in self._frames:
+                self._frames[p] = self.computeFrame(p)
+        return np.array([self._frames[p] for p in params]).reshape(-1, 4, 4)
+
+    def frameAt(self, par):
+        """Path local CS, as a 4x4 numpy matrix"""
+        return self.framesAt([par])[0]
+
+    def transitionMatrixAt(self, par):
+        """Path local CS"""
+        return FreeCAD.Matrix(*self.frameAt(par).flatten())
 
     def sort_profiles(self):
         self.LocalProfiles.sort(key=lambda x: x.Parameter)
@@ -532,13 +627,8 @@ class SweepInterpolator:
         locprofs = []
         for prof in self.Sweep.Profiles:
             # print(prof.Parameter)
-            m = self.transitionMatrixAt(prof.Parameter)
-            m = m.inverse()
-            locprof = prof.Curve.copy()
-            for i in range(locprof.NbPoles):
-                pole = locprof.getPole(i + 1)
-                np = m.multVec(pole)
-                locprof.setPole(i + 1, np)
+            m = np.linalg.inv(self.frameAt(prof.Parameter))
+            locprof = transform_poles(prof.Curve, m)
             locprof.translate(FreeCAD.Vector(0, prof.Parameter, 0))
             locprofs.append(LocalProfile(locprof, prof.Parameter))
         self.LocalProfiles = locprofs
@@ -565,23 +655,57 @@ class SweepInterpolator:
         # print(self.localLoft.getVKnots())
         return self.localLoft
 
-    def profileAt(self, par):
-        # print(f"extracting profile @ {par}")
+    def vIsoPoles(self, params):
+        """Returns the poles and weights arrays of the V isocurves
+        of the local loft at params, evaluated together on the pole grid"""
+        surf = self.localLoft
+        v0, v1 = surf.bounds()[2:]
+        if surf.isVPeriodic() or min(params) < v0 or max(params) > v1:
+            isos = [surf.vIso(par) for par in params]
+            return (np.array([c.getPoles() for c in isos], dtype=float),
+                    np.array([c.getWeights() for c in isos], dtype=float))
+        bb = BsplineBasis()
+        bb.degree = surf.VDegree
+        bb.knots = [k for k, m in zip(surf.getVKnots(), surf.getVMultiplicities()) for i in range(m)]
+        basis = np.zeros((len(params), surf.NbVPoles))
+        for row, par in zip(basis, params):
+            span = bb.find_span(par)
+            row[span - bb.degree:span + 1] = bb.basis_funs(span, par)
+        weights = np.array(surf.getWeights(), dtype=float)
+        hpoles = np.array(surf.getPoles(), dtype=float) * weights[..., None]
+        iso_weights = basis @ weights.T
+        iso_poles = np.einsum('pj,ijk->pik', basis, hpoles) / iso_weights[..., None]
+        return iso_poles, iso_weights
+
+    def profilesAt(self, params):
+        """Returns the list of the profiles at params.
+        The isocurves of the local loft and the path frames
+        are computed together for all the parameters"""
         if self.localLoft is None:
             self.interpolate_local_profiles()
-        locprof = self.localLoft.vIso(par)
-        fp = locprof.getPole(1)
-        locprof.translate(FreeCAD.Vector(0, -fp.y, 0))
-        m = self.transitionMatrixAt(par)
-        for i in range(locprof.NbPoles):
-            pole = locprof.getPole(i + 1)
-            np = m.multVec(pole)
-            locprof.setPole(i + 1, np)
-        if self.TopNormal:
-            pl = Part.Plane(locprof.getPole(1), self.TopNormal)
-            pt = pl.projectPoint(locprof.getPole(2))
-            locprof.setPole(2, pt)
-        return SweepProfile(locprof, par)
+        if len(params) == 0:
+            return []
+        surf = self.localLoft
+        poles, weights = self.vIsoPoles(params)
+        frames = self.framesAt(params)
+        # move the profiles to the origin, and to the path
+        poles[:, :, 1] -= poles[:, :1, 1].copy()
+        poles = np.einsum('pij,pkj->pki', frames[:, :3, :3], poles) + frames[:, None, :3, 3]
+        profiles = []
+        for par, pts, wl in zip(params, poles, weights):
+            pts = [FreeCAD.Vector(*p) for p in pts]
+            if self.TopNormal:
+                pl = Part.Plane(pts[0], self.TopNormal)
+                pts[1] = pl.projectPoint(pts[1])
+            locprof = Part.BSplineCurve()
+            locprof.buildFromPolesMultsKnots(pts, surf.getUMultiplicities(), surf.getUKnots(),
+                                             surf.isUPeriodic(), surf.UDegree, wl.tolist())
+            profiles.append(SweepProfile(locprof, par))
+        return profiles
+
+    def profileAt(self, par):
+        # print(f"extracting profile @ {par}")
+        return self.profilesAt([par])[0]
 
     def extend(self, periodic=False):
         """Add end profiles outside of the path range
@@ -625,19 +749,16 @@ class SweepInterpolator:
         u0, u1 = self.Sweep.Path.ParameterRange
         path_range = u1 - u0
         step = path_range / (self.NumExtra + 1)
-        profs = []
-        count = 1
+        extra_params = []
         for i in range(len(params) - 1):
             lrange = params[i + 1] - params[i]
             nb = int(lrange / step)
             lstep = lrange / (nb + 1)
             for j in range(nb):
                 par = params[i] + (j + 1) * lstep
-                debug(f"Insert profile #{count} @ {vec2str(par)}")
-                count += 1
-                intpro = self.profileAt(par)
-                profs.append(intpro)
-        self.Sweep.Profiles.extend(profs)
+                debug(f"Insert profile #{len(extra_params) + 1} @ {vec2str(par)}")
+                extra_params.append(par)
+        self.Sweep.Profiles.extend(self.profilesAt(extra_params))
 
     def compute(self):
         self.computeLocalProfiles()
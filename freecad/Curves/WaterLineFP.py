@@ -9,12 +9,43 @@ import os
 import FreeCAD
 import FreeCADGui
 import Part
+import numpy as np
 # from freecad.Curves import _utils
 from freecad.Curves import ICONPATH
+from freecad.Curves.lib.parallel import process_map, pool_context
 
 TOOL_ICON = os.path.join(ICONPATH, 'WaterLine.svg')
 
 
+def plane_section(origin, direction, surfaces):
+    "Returns the compound of the intersection edges of the plane (origin, direction) with the surfaces"
+    plane = Part.Plane(origin, direction)
+    edges = []
+    for surf in surfaces:
+        for itr in plane.intersectSS(surf):
+            edges.append(itr.toShape())
+    return Part.Compound(edges)
+
+
+def slice_faces(task):
+    """Process pool worker of WaterLineFP.execute
+    task = (direction, faces_data, planes)
+    faces_data is a dict {face index: BRep string of the face}
+    planes is a list of (origin, list of face indices)
+    Returns the list of the BRep strings of the sections of the planes"""
+    direction, faces_data, planes = task
+    surfaces = dict()
+    for idx, data in faces_data.items():
+        sh = Part.Shape()
+        sh.importBrepFromString(data)
+        surfaces[idx] = sh.Faces[0].Surface
+    res = []
+    for origin, indices in planes:
+        comp = plane_section(FreeCAD.Vector(*origin), FreeCAD.Vector(*direction), [surfaces[i] for i in indices])
+        res.append(comp.exportBrepToString())
+    return res
+
+
 # Reminder : Available properties
 """
 obj = FreeCAD.ActiveDocument.addObject("App::FeaturePython", "FeaturePython")
@@ -31,8 +62,13 @@ class WaterLineFP:
         obj.addProperty("App::PropertyLinkSubList", "Source", "Source", "The source face or object").Source = links
         obj.addProperty("App::PropertyInteger", "Number", "Settings", "The number of waterlines").Number = 4
         obj.addProperty("App::PropertyVector", "Direction", "Settings", "Axis of the cutting planes").Direction = FreeCAD.Vector(0, 0, 1)
+        obj.addProperty("App::PropertyInteger", "Workers", "Settings", "Number of processes computing the waterlines (not used in the GUI)").Workers = 1
         obj.Proxy = self
 
+    def onDocumentRestored(self, obj):
+        if not hasattr(obj, "Workers"):
+            obj.addProperty("App::PropertyInteger", "Workers", "Settings", "Number of processes computing the waterlines (not used in the GUI)").Workers = 1
+
     def get_source_shapes(self, obj):
         faces = []
         for link in obj.Source:
@@ -64,6 +100,41 @@ class WaterLineFP:
         # pars.sort()
         return pars
 
+    def face_candidates(self, line, faces, pars):
+        """Returns the list of the indices of the faces that can cross
+        the plane at each parameter of pars along line.
+        The faces are indexed by the extent of their bounding box along line"""
+        ranges = np.array([self.params(line, f) for f in faces]).reshape(-1, 8)
+        fmin = ranges.min(axis=1) - 1e-7
+        fmax = ranges.max(axis=1) + 1e-7
+        order = np.argsort(fmin, kind="stable")
+        sorted_min = fmin[order]
+        candidates = []
+        for par in pars:
+            cand = order[:np.searchsorted(sorted_min, par, side='right')]
+            candidates.append(np.sort(cand[fmax[cand] >= par]).tolist())
+        return candidates
+
+    def sections(self, obj, faces, axis, origins, candidates):
+        "Returns the list of the sections of faces by the planes (origin, axis)"
+        nb_workers = min(getattr(obj, "Workers", 1), len(origins))
+        if nb_workers > 1 and pool_context() is not None:
+            bounds = np.linspace(0, len(origins), nb_workers + 1).astype(int)
+            tasks = []
+            for i, j in zip(bounds[:-1], bounds[1:]):
+                used = sorted(set(idx for cand in candidates[i:j] for idx in cand))
+                faces_data = {idx: faces[idx].exportBrepToString() for idx in used}
+                planes = [((o.x, o.y, o.z), cand) for o, cand in zip(origins[i:j], candidates[i:j])]
+                tasks.append(((axis.x, axis.y, axis.z), faces_data, planes))
+            shapes = []
+            for chunk in process_map(slice_faces, tasks, nb_workers, name="Parallel waterlines"):
+                for data in chunk:
+                    sh = Part.Shape()
+                    sh.importBrepFromString(data)
+                    shapes.append(sh)
+            return shapes
+        return [plane_section(o, axis, [faces[i].Surface for i in cand]) for o, cand in zip(origins, candidates)]
+
     def execute(self, obj):
         faces = self.get_source_shapes(obj)
         # print(faces)
@@ -75,17 +146,11 @@ class WaterLineFP:
         minpar = min(pars)
         maxpar = max(pars)
         # print(minpar, maxpar)
-        shapes = []
-        for i in range(1, obj.Number + 1):
-            par = minpar + i * (maxpar - minpar) / (obj.Number + 1)
-            # print(par)
-            plane = Part.Plane(line.value(par), axis)
-            edges = []
-            for f in faces:
-                inter = plane.intersectSS(f.Surface)
-                for itr in inter:
-                    edges.append(itr.toShape())
-            shapes.append(Part.Compound(edges))
+        plane_pars = [minpar + i * (maxpar - minpar) / (obj.Number + 1) for i in range(1, obj.Number + 1)]
+        origins = [line.value(par) for par in plane_pars]
+        # only the faces whose bounding box reaches the plane are intersected
+        candidates = self.face_candidates(line, faces, plane_pars)
+        shapes = self.sections(obj, faces, axis, origins, candidates)
         compound = Part.Compound(shapes)
         obj.Shape = compound
 
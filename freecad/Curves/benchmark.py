@@ -0,0 +1,236 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+__title__ = "Benchmark"
+__author__ = "Christophe Grellier (Chris_G)"
+__license__ = "LGPL 2.1"
+__doc__ = """Benchmark suite of the NURBS core algorithms.
+Each case runs on synthetic inputs of scalable size,
+and reports the computation time and the peak python memory.
+
+Usage, in the FreeCAD python console, or with FreeCADCmd :
+from freecad.Curves import benchmark
+results = benchmark.run()
+benchmark.save(results, "/tmp/curves_bench.json")
+# later, after some code changes :
+benchmark.compare(benchmark.run(), benchmark.load("/tmp/curves_bench.json"))
+"""
+
+import json
+import time
+import tracemalloc
+from math import cos, pi, sin
+
+import FreeCAD
+import Part
+
+vec3 = FreeCAD.Vector
+message = FreeCAD.Console.PrintMessage
+
+
+# Synthetic inputs
+
+def wavy_points(nb_points, waves=3, amplitude=0.2):
+    "Returns a list of points along a wavy helical path"
+    pts = []
+    for i in range(nb_points):
+        t = float(i) / (nb_points - 1)
+        a = 2 * pi * t
+        pts.append(vec3(10 * t, 2 * cos(a) + amplitude * sin(waves * 2 * pi * t), 2 * sin(a)))
+    return pts
+
+
+def section_curves(nb_curves, nb_poles=10):
+    "Returns a list of nb_curves open BSpline curves of nb_poles poles"
+    curves = []
+    for i in range(nb_curves):
+        z = 10.0 * i / max(1, nb_curves - 1)
+        pts = []
+        for j in range(nb_poles):
+            a = pi * j / (nb_poles - 1)
+            r = 5 + 0.5 * sin(3 * a + i)
+            pts.append(vec3(r * cos(a), r * sin(a), z + 0.2 * sin(2 * a + i)))
+        bs = Part.BSplineCurve()
+        bs.interpolate(pts)
+        curves.append(bs)
+    return curves
+
+
+def curve_network(nb_profiles, nb_guides):
+    "Returns (profiles, guides), two lists of intersecting BSpline curves"
+    nu = max(nb_profiles, nb_guides) + 4
+    grid = []
+    for i in range(nu):
+        u = float(i) / (nu - 1)
+        row = []
+        for j in range(nu):
+            v = float(j) / (nu - 1)
+            row.append(vec3(10 * u, 10 * v, sin(2 * pi * u) * cos(pi * v)))
+        grid.append(row)
+    surf = Part.BSplineSurface()
+    surf.interpolate(grid)
+    u0, u1, v0, v1 = surf.bounds()
+    profiles = [surf.vIso(v0 + (v1 - v0) * i / (nb_profiles - 1)) for i in range(nb_profiles)]
+    guides = [surf.uIso(u0 + (u1 - u0) * i / (nb_guides - 1)) for i in range(nb_guides)]
+    return profiles, guides
+
+
+def blend_edges(nb_edges):
+    "Returns a list of pairs of edges to blend"
+    pairs = []
+    for i in range(nb_edges):
+        a = 2 * pi * i / nb_edges
+        e1 = Part.makeLine(vec3(0, 0, 0), vec3(cos(a), sin(a), 0))
+        e2 = Part.makeLine(vec3(5, 1, 1), vec3(5 + sin(a), 1 + cos(a), 2))
+        pairs.append((e1, e2))
+    return pairs
+
+
+# Benchmark cases
+
+def case_approximation(size):
+    "BSplineApproxInterp : fit a curve on 'size' points"
+    from freecad.Curves.BSplineApproxInterp import BSplineApproxInterp
+    pts = wavy_points(size)
+
+    def func():
+        approx = BSplineApproxInterp(pts, max(10, size // 50), 3, False)
+        approx.InterpolatePoint(0, False)
+        approx.InterpolatePoint(size - 1, False)
+        return approx.FitCurveOptimal([], 10)
+    return func
+
+
+def case_skinning(size):
+    "BSplineAlgorithms.curvesToSurface : skin 'size' curves"
+    from freecad.Curves.BSplineAlgorithms import BSplineAlgorithms
+    curves = section_curves(size, 20)
+    params = [float(i) / (size - 1) for i in range(size)]
+
+    def func():
+        return BSplineAlgorithms().curvesToSurface([c.copy() for c in curves], params, False)
+    return func
+
+
+def case_gordon(size):
+    "gordon.InterpolateCurveNetwork : network of 'size' profiles x 'size' guides"
+    from freecad.Curves.gordon import InterpolateCurveNetwork
+    profiles, guides = curve_network(size, size)
+
+    def func():
+        return InterpolateCurveNetwork(profiles, guides, 1e-2, 1e-5).surface()
+    return func
+
+
+def case_loft(size):
+    "curves_to_surface.CurvesToSurface : loft 'size' curves"
+    from freecad.Curves.curves_to_surface import CurvesToSurface
+    curves = section_curves(size, 20)
+
+    def func():
+        cts = CurvesToSurface([c.copy() for c in curves])
+        cts.set_parameters(1.0)
+        return cts.Surface
+    return func
+
+
+def case_blend(size):
+    "blend_curve.BlendCurve : 'size' G2 blend curves"
+    from freecad.Curves.blend_curve import BlendCurve, PointOnEdge
+    pairs = blend_edges(size)
+
+    def func():
+        res = []
+        for e1, e2 in pairs:
+            bc = BlendCurve(PointOnEdge(e1, e1.LastParameter, 2), PointOnEdge(e2, e2.FirstParameter, 2))
+            bc.auto_scale()
+            res.append(bc.perform())
+        return res
+    return func
+
+
+CASES = {"approximation": (case_approximation, [500, 2000, 10000]),
+         "skinning": (case_skinning, [10, 50, 200]),
+         "gordon": (case_gordon, [5, 10, 20]),
+         "loft": (case_loft, [10, 50, 200]),
+         "blend": (case_blend, [10, 100, 500])}
+
+
+# Measurement
+
+def measure(func, repeat=1):
+    """Runs func repeat times without instrumentation, and returns the best time (s).
+    Then runs it once more with tracemalloc, and returns the peak python memory
+    allocated by this run (MB).
+    Note that python memory does not include OCC allocations."""
+    best = float("inf")
+    for i in range(repeat):
+        tic = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - tic)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1] / 1048576.0
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run(cases=None, sizes=None, repeat=1, verbose=True):
+    """Run the benchmark cases.
+    - cases : list of case names (default : all the cases of CASES)
+    - sizes : list of input sizes, that overrides the default sizes of each case
+    - repeat : number of runs of each case. The best time is reported
+    Returns a list of result dictionaries"""
+    results = []
+    for name in (cases or list(CASES.keys())):
+        builder, default_sizes = CASES[name]
+        for size in (sizes or default_sizes):
+            res = {"case": name, "size": size}
+            try:
+                func = builder(size)
+                res["time"], res["python_peak_mb"] = measure(func, repeat)
+            except Exception as exc:
+                res["error"] = str(exc)
+            results.append(res)
+            if verbose:
+                message(format_result(res) + "\n")
+    return results
+
+
+def format_result(res):
+    "Returns a one line string of a result dictionary"
+    if "error" in res:
+        return "{:<14} {:>7} : ERROR {}".format(res["case"], res["size"], res["error"])
+    return "{:<14} {:>7} : {:9.4f} s  {:9.2f} MB (python)".format(res["case"], res["size"], res["time"], res["python_peak_mb"])
+
+
+def save(results, filename):
+    "Save results to a json file"
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=1)
+
+
+def load(filename):
+    "Load results from a json file"
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=1.2, verbose=True):
+    """Compare results to baseline results.
+    Returns the list of (case, size, ratio) whose time ratio is over threshold"""
+    base = {(r["case"], r["size"]): r for r in baseline if "time" in r}
+    regressions = []
+    for res in results:
+        ref = base.get((res["case"], res["size"]))
+        if ref is None or "time" not in res:
+            continue
+        ratio = res["time"] / max(ref["time"], 1e-9)
+        if verbose:
+            message("{:<14} {:>7} : {:6.2f} x\n".format(res["case"], res["size"], ratio))
+        if ratio > threshold:
+            regressions.append((res["case"], res["size"], ratio))
+    if verbose and regressions:
+        FreeCAD.Console.PrintWarning("{} regressions over {:0.2f} x\n".format(len(regressions), threshold))
+    return regressions
@@ -3,6 +3,7 @@
 import FreeCAD
 import FreeCADGui
 import Part
+import numpy as np
 from . import _utils
 from . import blend_curve as bc
 from .nurbs_tools import nurbs_quad
@@ -36,20 +37,53 @@ def get_link_size(w1, w2, offset, rev=1):
     return sum_len
 
 
+def get_wire_data(w, tangents=True):
+    """Returns the array of the points of the ordered vertexes of wire w,
+    and the array of the tangents of the ordered edges at these points"""
+    vertexes = w.OrderedVertexes
+    pts = np.array([v.Point for v in vertexes], dtype=float)
+    tans = np.zeros((0, 3))
+    if tangents:
+        tans = np.array([e.Curve.tangent(e.Curve.parameter(v.Point))[0] for v, e in zip(vertexes, w.OrderedEdges)], dtype=float)
+    return pts, tans
+
+
+def get_offset_scores(data1, data2, num, rev=1, torsion=True, chunk_size=2**20):
+    """Returns the array of the scores of the num vertex offsets (see get_link_torsion and get_link_size)
+    data1 and data2 are the wire data returned by get_wire_data"""
+    pts1, tans1 = data1
+    pts2, tans2 = data2
+    idx2 = (np.arange(num) * rev) % len(pts2)
+    scores = np.zeros(num)
+    step = max(1, chunk_size // max(1, num))
+    for first in range(0, num, step):
+        offsets = np.arange(first, min(num, first + step))
+        idx1 = (np.arange(num)[None, :] + offsets[:, None]) % num
+        cv = pts2[idx2][None, :, :] - pts1[idx1]
+        if not torsion:
+            scores[offsets] = np.linalg.norm(cv, axis=2).sum(axis=1)
+            continue
+        cvn = np.linalg.norm(cv, axis=2)
+        cvn[cvn == 0.0] = np.inf
+        for tans in (tans1[idx1], np.broadcast_to(tans2[idx2], cv.shape)):
+            tn = np.linalg.norm(tans, axis=2)
+            tn = np.where(tn == 0.0, np.inf, tn)
+            scores[offsets] += (np.abs(np.einsum('ijk,ijk->ij', cv, tans)) / (cvn * tn)).sum(axis=1)
+    return scores
+
+
 def get_vertex_offset(w1, w2, torsion=True):
-    if torsion:
-        func = get_link_torsion
-    else:
-        func = get_link_size
+    """Returns the vertex offset and direction that best link the vertexes of wires w1 and w2,
+    and the ratio of the 2 best scores.
+    The wire data is extracted once, and all the offsets are scored in a vectorized pass"""
     num = min(len(w1.Vertexes), len(w2.Vertexes))
-    lenlist = []
-    for offset in range(num):
-        lenlist.append(func(w1, w2, offset, rev=-1))
-    for offset in range(num):
-        lenlist.append(func(w1, w2, offset, rev=1))
-    offset = lenlist.index(min(lenlist)) - num
+    data1 = get_wire_data(w1, torsion)
+    data2 = get_wire_data(w2, torsion)
+    lenlist = np.concatenate([get_offset_scores(data1, data2, num, -1, torsion),
+                              get_offset_scores(data1, data2, num, 1, torsion)])
+    offset = int(np.argmin(lenlist)) - num
     lenlist.sort()
-    error = (lenlist[0] / lenlist[1])
+    error = float(lenlist[0] / lenlist[1])
     return offset, error
 
 
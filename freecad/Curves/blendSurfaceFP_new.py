@@ -39,6 +39,8 @@ class BlendSurfaceFP2:
                         "Scale", "Scale values along edge 1")
         obj.addProperty("App::PropertyFloatList", "Scale2",
                         "Scale", "Scale values along edge 2")
+        obj.addProperty("App::PropertyInteger", "Workers",
+                        "Scale", "Number of processes minimizing curvature (not used in the GUI)").Workers = 1
         obj.ScaleSamples = 3
         obj.Samples = 20
         obj.Continuity1 = 2
@@ -47,6 +49,11 @@ class BlendSurfaceFP2:
         obj.AutoScale = "RegularPoles"
         obj.Proxy = self
 
+    def onDocumentRestored(self, obj):
+        if not hasattr(obj, "Workers"):
+            obj.addProperty("App::PropertyInteger", "Workers",
+                            "Scale", "Number of processes minimizing curvature (not used in the GUI)").Workers = 1
+
     def get_input_shapes(self, obj):
         if hasattr(obj, "Sources"):
             edges = []
@@ -74,6 +81,7 @@ class BlendSurfaceFP2:
             if obj.AutoScale == "RegularPoles":
                 bs.auto_scale(obj.ScaleSamples)
             elif obj.AutoScale == "MinimizeCurvature":
+                bs.nb_workers = obj.Workers
                 bs.minimize_curvature(obj.ScaleSamples)
             obj.Scale1 = bs.edge1.size.values
             obj.Scale2 = bs.edge2.size.values
@@ -84,10 +92,14 @@ class BlendSurfaceFP2:
         if prop == "AutoScale":
             if obj.AutoScale == "Manual":
                 obj.setEditorMode("ScaleSamples", 2)
+                if hasattr(obj, "Workers"):
+                    obj.setEditorMode("Workers", 2)
                 obj.setEditorMode("Scale1", 0)
                 obj.setEditorMode("Scale2", 0)
             else:
                 obj.setEditorMode("ScaleSamples", 0)
+                if hasattr(obj, "Workers"):
+                    obj.setEditorMode("Workers", 0)
                 obj.setEditorMode("Scale1", 2)
                 obj.setEditorMode("Scale2", 2)
 
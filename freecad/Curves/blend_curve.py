@@ -15,6 +15,8 @@ import Part
 import numpy as np
 
 from .gordon import GordonSurfaceBuilder
+from .nurbs_tools import BsplineBasis
+from .lib.parallel import process_map, pool_context
 from . import _utils
 from . import curves_to_surface
 from . import TOL3D, TOL2D
@@ -30,6 +32,167 @@ vec3 = FreeCAD.Vector
 vec2 = FreeCAD.Base.Vector2d
 
 
+def vectors_data(vectors):
+    "Returns the list of vectors as a list of float tuples"
+    return [(v.x, v.y, v.z) for v in vectors]
+
+
+def smooth_range(values, gradients, sharpness=100.0):
+    """Returns a smooth (log-sum-exp) approximation of max(values) - min(values)
+    and its gradient, from the gradients of the values (array of shape (len(values), 2)).
+    The approximation gets closer to the real range as sharpness increases"""
+    vmax = values.max()
+    vmin = values.min()
+    wmax = np.exp(sharpness * (values - vmax))
+    wmin = np.exp(sharpness * (vmin - values))
+    smax = vmax + np.log(wmax.sum()) / sharpness
+    smin = vmin - np.log(wmin.sum()) / sharpness
+    return smax - smin, (wmax / wmax.sum()) @ gradients - (wmin / wmin.sum()) @ gradients
+
+
+class BlendCurveModel:
+    """Pure numpy formulation of a BlendCurve, as a function of its 2 scales.
+    Provides the poles and the scores used to optimize the scales,
+    with their analytic gradients, without building any OCC object.
+    - vectors1, vectors2 : unscaled point and derivative vectors of the 2 ends (see PointOnEdge)
+    - continuity1, continuity2 : number of derivative vectors used at each end
+    - chord_length : the reference length of the scales (see BlendCurve.scale1)
+    - nb_samples : number of curvature samples
+    The max - min differences of the scores are smoothed (see smooth_range),
+    so that they can be minimized by a gradient method.
+    Example :
+    model = BlendCurveModel(poe1._vectors, poe2._vectors, 2, 2, chord_length)
+    value, gradient = model.curvature_variation([0.5, -0.5])
+    """
+    def __init__(self, vectors1, vectors2, continuity1, continuity2, chord_length, nb_samples=32):
+        v1 = np.array(vectors1, dtype=float)
+        v2 = np.array(vectors2, dtype=float)
+        self.factors = (chord_length / np.linalg.norm(v1[1]), chord_length / np.linalg.norm(v2[1]))
+        self.vectors = (v1[:continuity1 + 1], v2[:continuity2 + 1])
+        self.chord_length = chord_length
+        self.sharpness = 100.0
+        self.degree = continuity1 + continuity2 + 1
+        n = self.degree
+        bb = BsplineBasis()
+        bb.knots = [0.0] * (n + 1) + [1.0] * (n + 1)
+        bb.degree = n
+        # the end derivatives are linear combinations of the poles
+        ends = bb.ders_basis_funs_array([n, n], [0.0, 1.0], max(continuity1, continuity2))
+        self.inverse = np.linalg.inv(np.vstack([ends[0, :continuity1 + 1], ends[1, :continuity2 + 1]]))
+        params = np.linspace(0.0, 1.0, nb_samples + 1)
+        ders = bb.ders_basis_funs_array(np.full(len(params), n), params, 2)
+        self.basis1 = ders[:, 1]
+        self.basis2 = ders[:, 2]
+
+    def poles(self, scales):
+        """Returns the poles, array of shape (degree + 1, 3)
+        and their derivatives with respect to the scales, array of shape (degree + 1, 3, 2)"""
+        cons = []
+        dcons = []
+        for i, (vecs, fac, s) in enumerate(zip(self.vectors, self.factors, scales)):
+            k = np.arange(len(vecs))
+            cons.append(vecs * ((fac * s) ** k)[:, None])
+            dfac = np.zeros(len(vecs))
+            dfac[1:] = k[1:] * fac ** k[1:] * s ** (k[1:] - 1)
+            dvecs = np.zeros((len(vecs), 3, 2))
+            dvecs[:, :, i] = vecs * dfac[:, None]
+            dcons.append(dvecs)
+        poles = self.inverse @ np.vstack(cons)
+        dpoles = np.einsum('ij,jcs->ics', self.inverse, np.concatenate(dcons))
+        return poles, dpoles
+
+    def curvature(self, scales):
+        """Returns the curvature samples, array of shape (nb_samples + 1)
+        and their derivatives with respect to the scales, array of shape (nb_samples + 1, 2)"""
+        poles, dpoles = self.poles(scales)
+        d1 = self.basis1 @ poles
+        d2 = self.basis2 @ poles
+        dd1 = np.einsum('mj,jcs->mcs', self.basis1, dpoles)
+        dd2 = np.einsum('mj,jcs->mcs', self.basis2, dpoles)
+        cross = np.cross(d1, d2)
+        cn = np.linalg.norm(cross, axis=1)
+        n1 = np.maximum(np.linalg.norm(d1, axis=1), 1e-50)
+        curv = cn / n1 ** 3
+        dcurv = np.zeros((len(curv), 2))
+        safe = np.where(cn > 0.0, cn, 1.0)
+        for i in range(2):
+            dcross = np.cross(dd1[:, :, i], d2) + np.cross(d1, dd2[:, :, i])
+            dcn = np.where(cn > 0.0, np.einsum('mc,mc->m', cross, dcross) / safe, 0.0)
+            dn1 = np.einsum('mc,mc->m', d1, dd1[:, :, i]) / n1
+            dcurv[:, i] = dcn / n1 ** 3 - 3 * cn * dn1 / n1 ** 4
+        return curv, dcurv
+
+    def curvature_variation(self, scales):
+        "Returns difference between max and min curvature along curve, and its gradient"
+        curv, dcurv = self.curvature(scales)
+        return smooth_range(curv, dcurv, self.sharpness * self.chord_length)
+
+    def _legs(self, scales):
+        poles, dpoles = self.poles(scales)
+        legs = np.diff(poles, axis=0)
+        dlegs = np.diff(dpoles, axis=0)
+        return legs, dlegs
+
+    def pole_regularity(self, scales):
+        """Returns the control polygon length plus the difference
+        between max and min distance between consecutive poles, and its gradient"""
+        legs, dlegs = self._legs(scales)
+        lengths = np.maximum(np.linalg.norm(legs, axis=1), 1e-50)
+        dlengths = np.einsum('mc,mcs->ms', legs, dlegs) / lengths[:, None]
+        value, gradient = smooth_range(lengths, dlengths, self.sharpness / self.chord_length)
+        return lengths.sum() + value, dlengths.sum(axis=0) + gradient
+
+    def angular_variation(self, scales):
+        "Returns difference between max and min angle between consecutive poles, and its gradient"
+        legs, dlegs = self._legs(scales)
+        a, b = legs[:-1], legs[1:]
+        da, db = dlegs[:-1], dlegs[1:]
+        if len(a) == 0:
+            return 0.0, np.zeros(2)
+        cross = np.cross(a, b)
+        sin = np.linalg.norm(cross, axis=1)
+        cos = np.einsum('mc,mc->m', a, b)
+        angles = np.arctan2(sin, cos)
+        safe = np.where(sin > 0.0, sin, 1.0)
+        dangles = np.zeros((len(angles), 2))
+        for i in range(2):
+            dcross = np.cross(da[:, :, i], b) + np.cross(a, db[:, :, i])
+            dsin = np.where(sin > 0.0, np.einsum('mc,mc->m', cross, dcross) / safe, 0.0)
+            dcos = np.einsum('mc,mc->m', da[:, :, i], b) + np.einsum('mc,mc->m', a, db[:, :, i])
+            dangles[:, i] = (cos * dsin - sin * dcos) / np.maximum(sin ** 2 + cos ** 2, 1e-50)
+        return smooth_range(angles, dangles, self.sharpness)
+
+
+def orientation_bounds(scales, min_scale=1e-3):
+    "Returns the minimization bounds that keep the sign of the scales"
+    return [(min_scale, None) if s > 0 else (None, -min_scale) for s in scales]
+
+
+def minimize_curvature_chunk(task):
+    """Minimize the curvature variation of a sequence of blend curves.
+    Process pool worker of BlendSurface.minimize_curvature
+    task = (stations, nb_samples, method, options)
+    stations is a list of (vectors1, vectors2, continuity1, continuity2, chord_length, initial_scales)
+    (see BlendCurveModel).
+    Each station is warm-started with the solution of the previous one.
+    Returns the list of optimal scales"""
+    stations, nb_samples, method, options = task
+    results = []
+    previous = None
+    for vectors1, vectors2, continuity1, continuity2, chord_length, initial in stations:
+        model = BlendCurveModel(vectors1, vectors2, continuity1, continuity2, chord_length, nb_samples)
+        if previous is None:
+            start = list(initial)
+        else:
+            # keep the orientation of this station
+            start = [np.copysign(abs(prev), init) for prev, init in zip(previous, initial)]
+        res = minimize(model.curvature_variation, start, jac=True, method=method,
+                       bounds=orientation_bounds(start), options=options)
+        previous = [float(x) for x in res.x]
+        results.append(previous)
+    return results
+
+
 class PointOnEdge:
     """Defines a point and some derivative vectors
     located at a given 'parameter' on an 'edge'.
@@ -241,7 +404,7 @@ class BlendCurve:
     """BlendCurve generates a bezier curve that
     smoothly interpolates two PointOnEdge objects"""
     def __init__(self, point1, point2):
-        self.min_method = 'Nelder-Mead'
+        self.min_method = 'L-BFGS-B'
         self.min_options = {"maxiter": 2000, "disp": False}
         self.point1 = point1
         self.point2 = point2
@@ -359,65 +522,45 @@ class BlendCurve:
         # print("Tan1 : {:3.3f}, Tan2 : {:3.3f}".format(self.point1.tangent.Length, self.point2.tangent.Length))
 
     # Curve evaluation methods
-    def _curvature_regularity_score(self, scales):
-        "Returns difference between max and min curvature along curve"
-        self.scale1, self.scale2 = scales
-        self.perform()
-        curva_list = [self.curve.curvature(p / self.nb_samples) for p in range(self.nb_samples + 1)]
-        return (max(curva_list) - min(curva_list))
-
-    def _cp_regularity_score(self, scales):
-        "Returns difference between max and min distance between consecutive poles"
-        self.scale1, self.scale2 = scales
-        self.perform()
-        pts = self.curve.getPoles()
-        vecs = []
-        for i in range(1, self.curve.NbPoles):
-            vecs.append(pts[i] - pts[i - 1])
-        poly = Part.makePolygon(pts)
-        llist = [v.Length for v in vecs]
-        return poly.Length + (max(llist) - min(llist))
-
-    def _total_cp_angular(self, scales):
-        "Returns difference between max and min angle between consecutive poles"
-        self.scale1, self.scale2 = scales
+    def model(self):
+        "Returns the numpy model of the BlendCurve, to evaluate scores of the scales"
+        return BlendCurveModel(self.point1._vectors, self.point2._vectors,
+                               self.point1.continuity, self.point2.continuity,
+                               self.chord_length, self.nb_samples)
+
+    def _minimize(self, score, scales=None):
+        """Minimize score(scales) -> (value, gradient), starting from scales,
+        or from auto oriented unit scales"""
+        if scales is None:
+            self.scales = 1.0
+            self.auto_orient()
+        else:
+            self.scale1, self.scale2 = scales
+        res = minimize(score,
+                       [self.scale1, self.scale2],
+                       jac=True,
+                       method=self.min_method,
+                       bounds=orientation_bounds([self.scale1, self.scale2]),
+                       options=self.min_options)
+        self.scale1, self.scale2 = res.x
         self.perform()
-        poly = Part.makePolygon(self.curve.getPoles())
-        angles = []
-        for i in range(1, len(poly.Edges)):
-            angles.append(poly.Edges[i - 1].Curve.Direction.getAngle(poly.Edges[i].Curve.Direction))
-        return (max(angles) - min(angles))
 
     def set_regular_poles(self):
         """Iterative function that sets
         a regular distance between control points"""
-        self.scales = 1.0
-        self.auto_orient()
-        minimize(self._cp_regularity_score,
-                 [self.scale1, self.scale2],
-                 method=self.min_method,
-                 options=self.min_options)
-
-    def minimize_curvature(self):
+        self._minimize(self.model().pole_regularity)
+
+    def minimize_curvature(self, scales=None):
         """Iterative function that tries to minimize
         the curvature along the curve
-        nb_samples controls the number of curvature samples"""
-        self.scales = 1.0
-        self.auto_orient()
-        minimize(self._curvature_regularity_score,
-                 [self.scale1, self.scale2],
-                 method=self.min_method,
-                 options=self.min_options)
+        nb_samples controls the number of curvature samples
+        The optional initial scales are used as a warm start"""
+        self._minimize(self.model().curvature_variation, scales)
 
     def minimize_angular_variation(self):
         """Iterative function that tries to minimize
         the angular deviation between consecutive control points"""
-        self.scales = 1.0
-        self.auto_orient()
-        minimize(self._total_cp_angular,
-                 [self.scale1, self.scale2],
-                 method=self.min_method,
-                 options=self.min_options)
+        self._minimize(self.model().angular_variation)
 
 
 class ValueOnEdge:
@@ -620,6 +763,7 @@ class EdgeOnFace:
         self._face = face
         self._edge = edge
         self._offset = None
+        self._cross_curves = dict()
         self._angle = ValueOnEdge(edge, 90.0)
         self._size = ValueOnEdge(edge, 1.0)
         self.continuity = continuity
@@ -763,9 +907,12 @@ class EdgeOnFace:
         - rel_par : the normalized parameter in [0.0, 1.0]
         - dist_par : the distance from start (if positive) or end (if negative)"""
         par = self._get_real_param(abs_par, rel_par, dist_par)
-        cc = self.cross_curve(abs_par=par)
-        d, pts, info = cc.distToShape(self._edge)
-        new_par = cc.Curve.parameter(pts[0][0])
+        # the cross curves only depend on edge and face
+        if par not in self._cross_curves:
+            cc = self.cross_curve(abs_par=par)
+            d, pts, info = cc.distToShape(self._edge)
+            self._cross_curves[par] = cc, cc.Curve.parameter(pts[0][0])
+        cc, new_par = self._cross_curves[par]
         size = self.size.value(abs_par=par)
         if cc:
             poe = PointOnEdge(cc, new_par, self.continuity, size)
@@ -791,6 +938,8 @@ class BlendSurface:
         self._ruled_surface = None
         self._surface = None
         self._curves = []
+        self._curves_key = None
+        self.nb_workers = 1
 
     def __repr__(self):
         return "{}(Edge1({}, G{}), Edge2({}, G{}))".format(self.__class__.__name__,
@@ -874,16 +1023,43 @@ class BlendSurface:
         return BlendCurve(self.edge1.valueAtPoint(e1.value(par)), self.edge2.valueAtPoint(e2.value(par)))
 
     def minimize_curvature(self, arg=3):
+        """Set the sizes of the 2 edges by minimizing the curvature variation
+        of the blend curves at arg stations.
+        If nb_workers > 1, the stations are split in nb_workers chunks of
+        consecutive stations, that are optimized in a process pool (see lib.parallel)"""
         self.edge1.size.reset()
         self.edge2.size.reset()
         e1, e2 = self.rails
-        for p in self.sample(arg):
+        params = self.sample(arg)
+        stations = []
+        bc = None
+        for p in params:
             bc = self.blendcurve_at(p)
-            # print("Minimizing curvature @ {:3.3f} = ({:3.3f}, {:3.3f})".format(p, bc.point1.size, bc.point2.size))
-            bc.minimize_curvature()
-            self.edge1.size.add(val=bc.point1.size, point=e1.value(p))
-            self.edge2.size.add(val=bc.point2.size, point=e2.value(p))
-            # print("Minimized curvature @ {:3.3f} = ({:3.3f}, {:3.3f})".format(p, bc.point1.size, bc.point2.size))
+            bc.auto_scale()
+            stations.append((vectors_data(bc.point1._vectors),
+                             vectors_data(bc.point2._vectors),
+                             bc.point1.continuity,
+                             bc.point2.continuity,
+                             bc.chord_length,
+                             bc.scales))
+        if bc is None:
+            return
+        results = self.minimize_stations(stations, bc.nb_samples, bc.min_method, bc.min_options)
+        for p, station, scales in zip(params, stations, results):
+            # print("Minimized curvature @ {:3.3f} = ({:3.3f}, {:3.3f})".format(p, scales[0], scales[1]))
+            self.edge1.size.add(val=scales[0] * station[4], point=e1.value(p))
+            self.edge2.size.add(val=scales[1] * station[4], point=e2.value(p))
+
+    def minimize_stations(self, stations, nb_samples, method, options):
+        "Returns the optimal scales of the stations (see minimize_curvature_chunk)"
+        nb_chunks = max(1, min(self.nb_workers, len(stations)))
+        if nb_chunks > 1 and pool_context() is None:
+            # a single chunk keeps the warm start along all the stations
+            nb_chunks = 1
+        bounds = np.linspace(0, len(stations), nb_chunks + 1).astype(int)
+        tasks = [(stations[i:j], nb_samples, method, options) for i, j in zip(bounds[:-1], bounds[1:])]
+        chunks = process_map(minimize_curvature_chunk, tasks, nb_chunks, name="Parallel minimization")
+        return [scales for chunk in chunks for scales in chunk]
 
     def auto_scale(self, arg=3):
         self.edge1.size.reset()
@@ -898,13 +1074,23 @@ class BlendSurface:
             # print("Auto scaling @ {:3.3f} = ({:3.3f}, {:3.3f})".format(p, bc.point1.size, bc.point2.size))
 
     def perform(self, arg=20):
+        """Compute the blend curves at arg stations.
+        The curves are kept until the number of stations,
+        the continuity or the sizes change"""
+        key = (arg, tuple(self.continuity),
+               tuple((p.x, p.y) for p in self.edge1.size._pts),
+               tuple((p.x, p.y) for p in self.edge2.size._pts))
+        if key == self._curves_key:
+            return
+        params = self.sample(arg)
         bc_list = []
-        for p in self.sample(arg):
+        for p in params:
             bc = self.blendcurve_at(p)
             # print("Computing BlendCurve @ {} from {} to {}".format(p, bc.point1.point, bc.point2.point))
             bc_list.append(bc.perform())
         self._curves = bc_list
-        self._params = self.sample(arg)
+        self._params = params
+        self._curves_key = key
 
 
 def test_blend_surface():
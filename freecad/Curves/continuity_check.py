@@ -8,9 +8,11 @@ __doc__ = 'Doc'
 import os
 import FreeCAD
 import FreeCADGui
-# import Part
+import Part
+import numpy as np
 # from freecad.Curves import _utils
 from freecad.Curves import ICONPATH
+from freecad.Curves.lib.parallel import process_map, pool_context
 from math import pi
 
 TOOL_ICON = os.path.join(ICONPATH, 'icon.svg')
@@ -73,11 +75,100 @@ from math import pi
 vec2 = FreeCAD.Base.Vector2d
 
 
+def face_uv(face, edge, params):
+    """Returns the array of the (u, v) parameters on face of the points of edge at params.
+    The pcurve of the edge is used if available, otherwise the points are projected"""
+    try:
+        pcurve = face.curveOnSurface(edge)
+    except Part.OCCError:
+        pcurve = None
+    if pcurve:
+        return np.array([[p.x, p.y] for p in (pcurve[0].value(t) for t in params)], dtype=float)
+    return np.array([face.Surface.parameter(edge.valueAt(t)) for t in params], dtype=float)
+
+
+def surface_derivatives(face, uv):
+    """Returns the arrays of points, normals and derivatives (Su, Sv, Suu, Suv, Svv)
+    of the surface of face at the (u, v) parameters.
+    Normals follow the face orientation"""
+    surf = face.Surface
+    ders = np.array([[surf.value(u, v),
+                      surf.getDN(u, v, 1, 0),
+                      surf.getDN(u, v, 0, 1),
+                      surf.getDN(u, v, 2, 0),
+                      surf.getDN(u, v, 1, 1),
+                      surf.getDN(u, v, 0, 2)] for u, v in uv], dtype=float).reshape(-1, 6, 3)
+    pts, su, sv, suu, suv, svv = np.moveaxis(ders, 1, 0)
+    normals = np.cross(su, sv)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-50)[:, None]
+    if face.Orientation == "Reversed":
+        normals = -normals
+    return pts, normals, (su, sv, suu, suv, svv)
+
+
+def normal_curvature(normals, derivatives, directions):
+    """Returns the normal curvatures of the surface in the 3D tangent directions,
+    from the fundamental forms computed with the surface derivatives"""
+    su, sv, suu, suv, svv = derivatives
+    dot = lambda a, b: np.einsum('ij,ij->i', a, b)
+    e, f, g = dot(su, su), dot(su, sv), dot(sv, sv)
+    # coordinates (a, b) of the directions in the (Su, Sv) basis
+    ds, dv = dot(directions, su), dot(directions, sv)
+    det = np.where(np.abs(e * g - f * f) > 1e-50, e * g - f * f, 1e-50)
+    a = (g * ds - f * dv) / det
+    b = (e * dv - f * ds) / det
+    first = e * a * a + 2 * f * a * b + g * b * b
+    second = dot(suu, normals) * a * a + 2 * dot(suv, normals) * a * b + dot(svv, normals) * b * b
+    return second / np.maximum(first, 1e-50)
+
+
+def summary(values):
+    "Returns the max, mean and min of an array"
+    if len(values) == 0:
+        return {"max": 0.0, "mean": 0.0, "min": 0.0}
+    return {"max": float(np.max(values)), "mean": float(np.mean(values)), "min": float(np.min(values))}
+
+
 class SeamSampler:
     def __init__(self, edge, faces):
         self.faces = faces
         self.seam = edge
 
+    def measure(self, samples=10):
+        """Measure the continuity between the 2 faces along the seam edge at samples points.
+        Returns a dictionary of arrays :
+        - parameters : the seam parameters of the samples
+        - points : the seam points
+        - gap : the distance between the points of the 2 faces (G0)
+        - angle : the signed angle from the normal of face1 to the normal of face2, in radians,
+          in [-pi, pi], positive counterclockwise around the seam tangent (G1)
+        - curvature1, curvature2 : the normal curvatures of the 2 faces, across the seam
+        - curvature_gap : the difference of the 2 curvatures (G2)
+        and a 'summary' dictionary of the max / mean / min of gap, angle and curvature_gap"""
+        params = np.linspace(self.seam.FirstParameter, self.seam.LastParameter, max(2, samples))
+        points = np.array([self.seam.valueAt(t) for t in params], dtype=float)
+        tangents = np.array([self.seam.tangentAt(t) for t in params], dtype=float)
+        f1, f2 = self.faces[:2]
+        pts1, n1, d1 = surface_derivatives(f1, face_uv(f1, self.seam, params))
+        pts2, n2, d2 = surface_derivatives(f2, face_uv(f2, self.seam, params))
+        cos = np.einsum('ij,ij->i', n1, n2)
+        # the cross seam direction, common to both faces
+        cross = np.cross(n1, tangents)
+        cross /= np.maximum(np.linalg.norm(cross, axis=1), 1e-50)[:, None]
+        # the normals follow the face orientations,
+        # so a crease or a flipped face shows up in the angle
+        curv1 = normal_curvature(n1, d1, cross)
+        curv2 = normal_curvature(n2, d2, cross)
+        res = {"parameters": params,
+               "points": points,
+               "gap": np.linalg.norm(pts1 - pts2, axis=1),
+               "angle": np.arctan2(np.einsum('ij,ij->i', np.cross(n1, n2), tangents), cos),
+               "curvature1": curv1,
+               "curvature2": curv2,
+               "curvature_gap": np.abs(curv1 - curv2)}
+        res["summary"] = {key: summary(res[key]) for key in ("gap", "angle", "curvature_gap")}
+        return res
+
     def lines2d(self, nb):
         lines = []
         line = Part.Geom2d.Line2dSegment(vec2(-0.1, 0), vec2(0.1, 0))
@@ -100,7 +191,6 @@ class SeamSampler:
             avn = 0.5 * (n1 + n2)
             t = self.seam.tangentAt(self.seam.Curve.parameter(pt))
             y = avn.cross(t)
-            print(y)
             plane = Part.Plane(pt, pt + t, pt + y)
             star = self.edges2d(checker, plane)
             for e in star:
@@ -110,6 +200,50 @@ class SeamSampler:
         return proj
 
 
+def shared_edges(shape):
+    "Returns the list of (edge index, [face1, face2]) of the edges of shape shared by 2 faces"
+    res = []
+    for i, e in enumerate(shape.Edges):
+        try:
+            faces = shape.ancestorsOfType(e, Part.Face)
+        except Part.OCCError:
+            continue
+        if len(faces) == 2 and not faces[0].isSame(faces[1]):
+            res.append((i, faces))
+    return res
+
+
+def shape_continuity(shape, samples=10):
+    """Measure the continuity along all the edges shared by 2 faces of shape.
+    Returns a list of (edge index, results) (see SeamSampler.measure)"""
+    res = []
+    for i, faces in shared_edges(shape):
+        try:
+            res.append((i, SeamSampler(shape.Edges[i], faces).measure(samples)))
+        except Exception as exc:
+            FreeCAD.Console.PrintWarning("Continuity check of Edge{} failed : {}\n".format(i + 1, exc))
+    return res
+
+
+def shape_continuity_task(task):
+    """Process pool worker of continuity_report
+    task = (BRep string of the shape, samples)"""
+    data, samples = task
+    shape = Part.Shape()
+    shape.importBrepFromString(data)
+    return shape_continuity(shape, samples)
+
+
+def continuity_report(shapes, samples=10, nb_workers=1):
+    """Measure the continuity of the shared edges of a list of shapes.
+    If nb_workers > 1, the shapes are processed in a process pool (see lib.parallel).
+    Returns a list of shape_continuity results, one per shape"""
+    if nb_workers > 1 and len(shapes) > 1 and pool_context() is not None:
+        tasks = [(sh.exportBrepToString(), samples) for sh in shapes]
+        return process_map(shape_continuity_task, tasks, nb_workers, name="Parallel continuity check")
+    return [shape_continuity(sh, samples) for sh in shapes]
+
+
 """
 doc1 = FreeCAD.getDocument('blendsurface')
 o1 = doc1.getObject('Blend_Surface002')
@@ -7,6 +7,7 @@ __doc__ = "Interpolate curves to surface"
 
 import FreeCAD
 import Part
+import numpy as np
 from freecad.Curves import _utils
 
 
@@ -153,22 +154,28 @@ def orient_curves(c1, c2):
         return True
 
 
+def twist_offset(pts1, pts2, chunk_size=64):
+    """Returns the cyclic offset of the points pts2 that minimizes
+    the sum of the distances to the points pts1.
+    The offsets are tested in chunks of chunk_size, with numpy arrays"""
+    pts1 = np.asarray(pts1, dtype=float)
+    pts2 = np.asarray(pts2, dtype=float)
+    num = len(pts1)
+    idx = np.arange(num)
+    scores = np.empty(num)
+    for start in range(0, num, chunk_size):
+        offsets = np.arange(start, min(start + chunk_size, num))
+        shifted = pts2[(idx[None, :] + offsets[:, None]) % num]
+        scores[offsets] = np.linalg.norm(shifted - pts1[None, :, :], axis=2).sum(axis=1)
+    return int(np.argmin(scores))
+
+
 def shift_origin(c1, c2, num=36):
     """if c1 and c2 are two periodic BSpline curves
     c2 origin will be moved to minimize twist"""
     pts1 = c1.discretize(num)
     pts2 = c2.discretize(num)
-    pts2 *= 2
-    min_dist = 1e50
-    good_offset = 0
-    for offset_idx in range(num):
-        total_length = 0
-        for pt_idx in range(num):
-            ls = Part.makeLine(pts1[pt_idx], pts2[pt_idx + offset_idx])
-            total_length += ls.Length
-        if total_length < min_dist:
-            min_dist = total_length
-            good_offset = offset_idx
+    good_offset = twist_offset(pts1, pts2)
     knot = c2.parameter(pts2[good_offset])
     c2.insertKnot(knot, 1)
     fk = _find_knot(c2, knot, 1e-9)
@@ -485,18 +492,55 @@ class CurvesToSurface:
             op[i] /= ow[i]
         return op, ow, bs
 
+    def interpolation_matrix(self):
+        """Returns the interpolating curve of the curves indices,
+        and the matrix of its basis functions at the parameters.
+        The interpolation is linear, so each column of the matrix is
+        the curve with one unit pole, evaluated at the parameters"""
+        nb = len(self.curves)
+        bs = Part.BSplineCurve()
+        bs.interpolate(Points=[FreeCAD.Vector(i, 0, 0) for i in range(nb)],
+                       Parameters=self.Parameters, PeriodicFlag=self.Periodic)
+        probe = bs.copy()
+        for i in range(1, probe.NbPoles + 1):
+            probe.setPole(i, FreeCAD.Vector())
+        matrix = np.zeros((nb, probe.NbPoles))
+        for j in range(probe.NbPoles):
+            probe.setPole(j + 1, FreeCAD.Vector(1, 0, 0))
+            matrix[:, j] = [probe.value(t).x for t in self.Parameters[:nb]]
+            probe.setPole(j + 1, FreeCAD.Vector())
+        return bs, matrix
+
+    def solve_poles(self):
+        """Interpolate the poles and weights of the curves, with a single
+        factorization of the interpolation matrix, for all the pole indices.
+        Returns the poles and weights arrays, and the interpolating curve"""
+        bs, matrix = self.interpolation_matrix()
+        weights = np.array([c.getWeights() for c in self.curves], dtype=float)
+        poles = np.array([c.getPoles() for c in self.curves], dtype=float) * weights[..., None]
+        # one right hand side column per coordinate (x*w, y*w, z*w, w) of each pole index
+        rhs = np.concatenate([poles, weights[..., None]], axis=2).reshape(len(self.curves), -1)
+        sol = np.linalg.solve(matrix, rhs).reshape(matrix.shape[1], -1, 4)
+        ow = sol[..., 3].T
+        op = sol[..., :3].transpose(1, 0, 2) / ow[..., None]
+        poles_array = [[FreeCAD.Vector(*p) for p in row] for row in op]
+        return poles_array, ow.tolist(), bs
+
     def interpolate(self):
         "interpolate the poles of the curves and build the surface"
         if self.Parameters is None:
             self.set_parameters(1.0)
         # nbp = [c.NbPoles for c in self.curves]
         # print(nbp)
-        poles_array = []
-        weights_array = []
-        for pole_idx in range(1, self.curves[0].NbPoles + 1):
-            op, ow, bs = self.pts_weights_interp(pole_idx)
-            poles_array.append(op)
-            weights_array.append(ow)
+        try:
+            poles_array, weights_array, bs = self.solve_poles()
+        except (np.linalg.LinAlgError, Part.OCCError):
+            poles_array = []
+            weights_array = []
+            for pole_idx in range(1, self.curves[0].NbPoles + 1):
+                op, ow, bs = self.pts_weights_interp(pole_idx)
+                poles_array.append(op)
+                weights_array.append(ow)
         maxlen = 0
         for poles in poles_array:
             maxlen = max(maxlen, len(poles))
@@ -29,8 +29,11 @@
 
 import FreeCAD
 import Part
+import numpy as np
 # from math import pi
 from freecad.Curves.BSplineAlgorithms import BSplineAlgorithms
+from freecad.Curves.lib.aabb_tree import AABBTree
+from freecad.Curves.lib.parallel import process_map
 from freecad.Curves import curve_network_sorter
 
 DEBUG = False
@@ -75,12 +78,87 @@ def find(val, array, tol=1e-5):
     return -1
 
 
+def curve_data(curve):
+    """Returns the data needed to rebuild a BSpline curve in another process"""
+    return ([(p.x, p.y, p.z) for p in curve.getPoles()],
+            curve.getMultiplicities(),
+            curve.getKnots(),
+            curve.isPeriodic(),
+            curve.Degree,
+            curve.getWeights(),
+            curve.isRational())
+
+
+def curve_from_data(data):
+    """Rebuild a BSpline curve from the output of curve_data()"""
+    poles, mults, knots, periodic, degree, weights, rational = data
+    bs = Part.BSplineCurve()
+    bs.buildFromPolesMultsKnots([FreeCAD.Vector(*p) for p in poles], mults, knots, periodic, degree, weights, rational)
+    return bs
+
+
+def curve_key(curve):
+    """Returns a hashable key of the geometry of a BSpline curve"""
+    poles, mults, knots, periodic, degree, weights, rational = curve_data(curve)
+    return (tuple(poles), tuple(mults), tuple(knots), periodic, degree, tuple(weights), rational)
+
+
+class GordonCache(object):
+    """Cache of the intermediate results of InterpolateCurveNetwork,
+    keyed by the geometry of the curves they depend on.
+    The stored objects must not be modified : store and retrieve copies.
+    Entries that have not been used since the last call to prune() are dropped by prune()"""
+
+    def __init__(self):
+        self.data = dict()
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "GordonCache ({} entries, {} hits, {} misses)".format(len(self.data), self.hits, self.misses)
+
+    def get(self, key):
+        if key in self.data:
+            self.used.add(key)
+            self.hits += 1
+            return self.data[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.used.add(key)
+
+    def prune(self):
+        self.data = {k: v for k, v in self.data.items() if k in self.used}
+        self.used = set()
+
+
+def intersect_curves(spline1, spline2, par_tolerance, seeds=None):
+    """Returns the list of intersection parameters [param1, param2] of spline1 with spline2
+    seeds is the list of parameter ranges (s0, s1, t0, t1) of curve segments that may intersect.
+    If seeds is None, the curves can't intersect, and the parameters of the closest points are returned"""
+    bsa = BSplineAlgorithms(par_tolerance)
+    if seeds is None:
+        return [bsa.closestParameters(spline1, spline2)]
+    return bsa.intersections(spline1, spline2, par_tolerance, seeds)
+
+
+def intersect_pair(task):
+    """Process pool worker of intersect_curves
+    task = (profile_idx, guide_idx, profile_data, guide_data, par_tolerance, seeds)
+    Returns (profile_idx, guide_idx, list of [param1, param2])"""
+    i, j, data1, data2, par_tolerance, seeds = task
+    return i, j, intersect_curves(curve_from_data(data1), curve_from_data(data2), par_tolerance, seeds)
+
+
 class GordonSurfaceBuilder(object):
     """Build a Gordon surface from a network of curves"""
 
     def __init__(self, profiles, guides,
                  params_u, params_v,
-                 tol=1e-7, par_tol=1e-12):
+                 tol=1e-7, par_tol=1e-12, cache=None):
         debug("-- GordonSurfaceBuilder initialisation")
         debug("{} profiles and {} guides".format(len(profiles),
                                                  len(guides)))
@@ -93,6 +171,7 @@ class GordonSurfaceBuilder(object):
             self.guides = guides
         self.intersectionParamsU = params_u
         self.intersectionParamsV = params_v
+        self.cache = cache
         self.has_performed = False
         if tol > 0.0:
             self.tolerance = tol
@@ -130,6 +209,30 @@ class GordonSurfaceBuilder(object):
         guides = Part.Compound([c.toShape() for c in self.guides])
         return Part.Compound([profiles, guides])
 
+    def curves_to_surface(self, bsa, curves, params, closed):
+        """Cached BSplineAlgorithms.curvesToSurface"""
+        if self.cache is None:
+            return bsa.curvesToSurface(curves, params, closed)
+        key = ("skinning", tuple([curve_key(c) for c in curves]), tuple(params), closed)
+        surf = self.cache.get(key)
+        if surf is None:
+            surf = bsa.curvesToSurface(curves, params, closed)
+            self.cache.set(key, surf.copy())
+        return surf.copy()
+
+    def points_to_surface(self, bsa, points, params_u, params_v, u_closed, v_closed):
+        """Cached BSplineAlgorithms.pointsToSurface"""
+        if self.cache is None:
+            return bsa.pointsToSurface(points, params_u, params_v, u_closed, v_closed)
+        key = ("tensor",
+               tuple([tuple([(p.x, p.y, p.z) for p in row]) for row in points]),
+               tuple(params_u), tuple(params_v), u_closed, v_closed)
+        surf = self.cache.get(key)
+        if surf is None:
+            surf = bsa.pointsToSurface(points, params_u, params_v, u_closed, v_closed)
+            self.cache.set(key, surf.copy())
+        return surf.copy()
+
     def create_gordon_surface(self):
         if len(self.profiles) < 2:
             self.error("There must be at least two profiles")
@@ -180,18 +283,18 @@ class GordonSurfaceBuilder(object):
         #  Skinning in v-direction with u directional B-Splines
         debug("-   Skinning profiles")
         debug("VClosed = {}".format(makeVClosed))
-        surfProfiles = bsa.curvesToSurface(self.profiles,
-                                           self.intersectionParamsV,
-                                           makeVClosed)
+        surfProfiles = self.curves_to_surface(bsa, self.profiles,
+                                              self.intersectionParamsV,
+                                              makeVClosed)
         debug(surfProfiles)
         #  therefore reparametrization before this method
 
         #  Skinning in u-direction with v directional B-Splines
         debug("-   Skinning guides")
         debug("UClosed = {}".format(makeUClosed))
-        surfGuides = bsa.curvesToSurface(self.guides,
-                                         self.intersectionParamsU,
-                                         makeUClosed)
+        surfGuides = self.curves_to_surface(bsa, self.guides,
+                                            self.intersectionParamsU,
+                                            makeUClosed)
         debug(surfGuides)
 
         #  flipping of the surface in v-direction
@@ -205,10 +308,10 @@ class GordonSurfaceBuilder(object):
         debug("-   Skinning intersection points")
         debug("UClosed = {}".format(makeUClosed))
         debug("VClosed = {}".format(makeVClosed))
-        tensorProdSurf = bsa.pointsToSurface(intersection_pnts,
-                                             self.intersectionParamsU,
-                                             self.intersectionParamsV,
-                                             makeUClosed, makeVClosed)
+        tensorProdSurf = self.points_to_surface(bsa, intersection_pnts,
+                                                self.intersectionParamsU,
+                                                self.intersectionParamsV,
+                                                makeUClosed, makeVClosed)
         debug(tensorProdSurf)
 
         #  match degree of all three surfaces
@@ -306,6 +409,11 @@ class InterpolateCurveNetwork(object):
         if tol2 > 0.0:
             self.par_tolerance = tol2
         self.max_ctrl_pts = 80
+        #  number of worker processes used to compute the intersections
+        #  (only used without GUI, see lib.parallel)
+        self.nb_workers = 1
+        #  optional GordonCache, to reuse the results of a previous computation
+        self.cache = None
         self.has_performed = False
         if (len(profiles) < 2) or (len(guides) < 2):
             self.error("Not enough guides or profiles")
@@ -318,13 +426,27 @@ class InterpolateCurveNetwork(object):
     def perform(self):
         if self.has_performed:
             return
+        key = None
+        if self.cache is not None:
+            key = ("network",
+                   tuple([curve_key(c) for c in self.profiles]),
+                   tuple([curve_key(c) for c in self.guides]),
+                   self.tolerance, self.par_tolerance, self.max_ctrl_pts)
+            res = self.cache.get(key)
+            if res is not None:
+                debug("-> Gordon surface found in cache")
+                surfaces, self.curve_network, self.intersectionParamsU, self.intersectionParamsV = res
+                self.gordon_surf, self.skinning_surf_profiles, self.skinning_surf_guides, self.tensor_prod_surf = [su.copy() for su in surfaces]
+                self.has_performed = True
+                return
         debug("-> ")
         self.make_curves_compatible()
         debug("-> make_curves_compatible -> OK")
         builder = GordonSurfaceBuilder(self.profiles, self.guides,
                                        self.intersectionParamsU,
                                        self.intersectionParamsV,
-                                       self.tolerance, self.par_tolerance)
+                                       self.tolerance, self.par_tolerance,
+                                       self.cache)
         debug("-> GordonSurfaceBuilder -> OK")
         self.gordon_surf = builder.surface_gordon()
         debug("-> builder.surface_gordon -> OK")
@@ -335,6 +457,11 @@ class InterpolateCurveNetwork(object):
         self.tensor_prod_surf = builder.surface_intersections()
         self.curve_network = builder.curve_network()
         self.has_performed = True
+        if self.cache is not None:
+            surfaces = [self.gordon_surf, self.skinning_surf_profiles, self.skinning_surf_guides, self.tensor_prod_surf]
+            self.cache.set(key, ([su.copy() for su in surfaces], self.curve_network,
+                                 list(self.intersectionParamsU), list(self.intersectionParamsV)))
+            self.cache.prune()
         debug("-> builder successfully finished")
 
     def surface_profiles(self):
@@ -365,15 +492,82 @@ class InterpolateCurveNetwork(object):
         self.perform()
         return self.curve_network
 
+    def intersect_network(self):
+        """Returns the matrix of intersection parameters of each profile with each guide
+        The knot span control polygons of the guides are indexed in an AABB tree.
+        Each knot span of a profile is checked against this tree,
+        and the overlapping span pairs are used as seeds of the intersection algorithm.
+        Pairs of curves with no overlapping spans can't intersect.
+        If self.nb_workers > 1, the pairs are dispatched to a process pool (see lib.parallel)"""
+        bsa = BSplineAlgorithms(self.par_tolerance)
+        bb_tol = self.tolerance * bsa.scale(self.profiles + self.guides)
+        guide_boxes = list()
+        guide_ranges = list()
+        guide_owner = list()
+        for spline_v_idx, guide in enumerate(self.guides):
+            boxes, ranges = bsa.spanBoxes(guide, bb_tol)
+            guide_boxes.append(boxes)
+            guide_ranges.extend(ranges)
+            guide_owner.extend([spline_v_idx] * len(ranges))
+        tree = AABBTree(np.concatenate(guide_boxes))
+
+        seeds = dict()
+        for spline_u_idx, profile in enumerate(self.profiles):
+            boxes, ranges = bsa.spanBoxes(profile, bb_tol)
+            for (s0, s1), overlapping in zip(ranges, tree.query_boxes(boxes)):
+                for k in overlapping:
+                    t0, t1 = guide_ranges[k]
+                    seeds.setdefault((spline_u_idx, guide_owner[k]), []).append((s0, s1, t0, t1))
+
+        pairs = list()
+        for spline_u_idx in range(len(self.profiles)):
+            for spline_v_idx in range(len(self.guides)):
+                pair_seeds = seeds.get((spline_u_idx, spline_v_idx))
+                if pair_seeds is None:
+                    self.error("Profile {} and guide {} don't intersect each other".format(spline_u_idx, spline_v_idx))
+                pairs.append((spline_u_idx, spline_v_idx, pair_seeds))
+
+        results = [[list() for j in range(len(self.guides))] for i in range(len(self.profiles))]
+        if self.cache is not None:
+            profile_keys = [curve_key(c) for c in self.profiles]
+            guide_keys = [curve_key(c) for c in self.guides]
+            remaining = list()
+            for i, j, pair_seeds in pairs:
+                inters = self.cache.get(("intersection", profile_keys[i], guide_keys[j], self.tolerance, self.par_tolerance))
+                if inters is None:
+                    remaining.append((i, j, pair_seeds))
+                else:
+                    results[i][j] = [list(par) for par in inters]
+            self.compute_pairs(remaining, results)
+            for i, j, pair_seeds in remaining:
+                self.cache.set(("intersection", profile_keys[i], guide_keys[j], self.tolerance, self.par_tolerance),
+                               [list(par) for par in results[i][j]])
+            return results
+        self.compute_pairs(pairs, results)
+        return results
+
+    def compute_pairs(self, pairs, results):
+        """Fill the results matrix with the intersection parameters of the pairs
+        (profile_idx, guide_idx, seeds) of curves"""
+        if self.nb_workers > 1 and len(pairs) > 1:
+            profile_data = [curve_data(c) for c in self.profiles]
+            guide_data = [curve_data(c) for c in self.guides]
+            tasks = [(i, j, profile_data[i], guide_data[j], self.par_tolerance, pair_seeds) for i, j, pair_seeds in pairs]
+            chunksize = max(1, len(tasks) // (4 * self.nb_workers))
+            for i, j, inters in process_map(intersect_pair, tasks, self.nb_workers, chunksize, name="Parallel intersection"):
+                results[i][j] = inters
+            return
+        for i, j, pair_seeds in pairs:
+            debug("Intersection of profile # {} with guide # {}".format(i, j))
+            results[i][j] = intersect_curves(self.profiles[i], self.guides[j], self.par_tolerance, pair_seeds)
+
     def compute_intersections(self, intersection_params_u,
                               intersection_params_v):
         debug("\ncompute_intersections")
+        intersections = self.intersect_network()
         for spline_u_idx in range(len(self.profiles)):
             for spline_v_idx in range(len(self.guides)):
-                debug("Intersection of profile # {} with guide # {}".format(spline_u_idx, spline_v_idx))
-                currentIntersections = BSplineAlgorithms(self.par_tolerance).intersections(self.profiles[spline_u_idx],
-                                                                                           self.guides[spline_v_idx],
-                                                                                           self.par_tolerance)
+                currentIntersections = intersections[spline_u_idx][spline_v_idx]
                 if len(currentIntersections) < 1:
                     self.error("U-directional B-spline and v-directional B-spline don't intersect each other!")
                     self.error("profile {} / guide {}".format(spline_u_idx, spline_v_idx))
@@ -437,6 +631,19 @@ class InterpolateCurveNetwork(object):
         self.guides = sorterObj.guides
         return intersection_params_u, intersection_params_v
 
+    def reparametrize(self, bsa, curve, old_params, new_params, max_cp):
+        """Cached BSplineAlgorithms.reparametrizeBSplineContinuouslyApprox"""
+        if self.cache is None:
+            return bsa.reparametrizeBSplineContinuouslyApprox(curve, old_params, new_params, max_cp)
+        key = ("reparametrize", curve_key(curve), tuple(old_params), tuple(new_params), max_cp)
+        res = self.cache.get(key)
+        if res is None:
+            res = bsa.reparametrizeBSplineContinuouslyApprox(curve, old_params, new_params, max_cp)
+            if res is None:
+                return None
+            self.cache.set(key, res.copy())
+        return res.copy()
+
     def make_curves_compatible(self):
         #  reparametrize into [0,1]
         bsa = BSplineAlgorithms()
@@ -531,7 +738,7 @@ class InterpolateCurveNetwork(object):
             profile = self.profiles[spline_u_idx]
             debug("\nreparametrizing u curve {}".format(spline_u_idx))
             debug(profile)
-            self.profiles[spline_u_idx] = bsa.reparametrizeBSplineContinuouslyApprox(profile, oldParametersProfile, newParametersProfiles, max_cp_u)
+            self.profiles[spline_u_idx] = self.reparametrize(bsa, profile, oldParametersProfile, newParametersProfiles, max_cp_u)
             # debug(self.profiles[spline_u_idx])
             if hasProgressBar:
                 progressbar.next()
@@ -555,7 +762,7 @@ class InterpolateCurveNetwork(object):
             guide = self.guides[spline_v_idx]
             debug("\nreparametrizing v curve {}".format(spline_v_idx))
             debug(guide)
-            self.guides[spline_v_idx] = bsa.reparametrizeBSplineContinuouslyApprox(guide, oldParameterGuide, newParametersGuides, max_cp_v)
+            self.guides[spline_v_idx] = self.reparametrize(bsa, guide, oldParameterGuide, newParametersGuides, max_cp_v)
             # debug(self.guides[spline_v_idx])
             if hasProgressBar:
                 progressbar.next()
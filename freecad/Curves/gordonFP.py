@@ -12,7 +12,7 @@ import FreeCADGui
 import Part
 # from freecad.Curves import _utils
 from freecad.Curves import ICONPATH
-from freecad.Curves.gordon import InterpolateCurveNetwork
+from freecad.Curves.gordon import InterpolateCurveNetwork, GordonCache
 
 TOOL_ICON = os.path.join(ICONPATH, 'gordon.svg')
 DEBUG = False
@@ -56,6 +56,7 @@ class gordonFP:
         obj.addProperty("App::PropertyFloat", "Tol3D", "Gordon", "3D tolerance").Tol3D = 1e-2
         obj.addProperty("App::PropertyFloat", "Tol2D", "Gordon", "Parametric tolerance").Tol2D = 1e-5
         obj.addProperty("App::PropertyInteger", "MaxCtrlPts", "Gordon", "Max Number of control points").MaxCtrlPts = 80
+        obj.addProperty("App::PropertyInteger", "Workers", "Gordon", "Number of processes computing the curve intersections (not used in the GUI)").Workers = 1
         obj.addProperty("App::PropertyEnumeration", "Output", "Base", "Output type").Output = ["Surface", "Wireframe"]
         obj.addProperty("App::PropertyInteger", "SamplesU", "Wireframe", "Number of samples in U direction").SamplesU = 16
         obj.addProperty("App::PropertyInteger", "SamplesV", "Wireframe", "Number of samples in V direction").SamplesV = 16
@@ -65,10 +66,13 @@ class gordonFP:
         obj.setEditorMode("SamplesU", 2)
         obj.setEditorMode("SamplesV", 2)
         obj.Proxy = self
+        self.cache = GordonCache()
 
     def onDocumentRestored(self, fp):
         if not hasattr(fp, "Output"):
             fp.addProperty("App::PropertyEnumeration", "Output", "Base", "Output type").Output = ["Surface", "Wireframe"]
+        if not hasattr(fp, "Workers"):
+            fp.addProperty("App::PropertyInteger", "Workers", "Gordon", "Number of processes computing the curve intersections (not used in the GUI)").Workers = 1
 
     def onChanged(self, fp, prop):
         if prop == "Output":
@@ -128,6 +132,11 @@ class gordonFP:
         # create the gordon surface
         gordon_surf = InterpolateCurveNetwork(profile_curves, guide_curves, obj.Tol3D, obj.Tol2D)
         gordon_surf.max_ctrl_pts = obj.MaxCtrlPts
+        gordon_surf.nb_workers = obj.Workers
+        # intermediate results are reused when only some curves of the network change
+        if not hasattr(self, "cache"):
+            self.cache = GordonCache()
+        gordon_surf.cache = self.cache
         # gordon.perform()
         # s = gordon.surface_intersections()
         # debug(s)
@@ -159,6 +168,20 @@ class gordonFP:
             obj.Shape = f
         del gordon_surf
 
+    if FreeCAD.Version()[0] == '0' and '.'.join(FreeCAD.Version()[1:3]) >= '21.2':
+        def dumps(self):
+            return None
+
+        def loads(self, state):
+            return None
+
+    else:
+        def __getstate__(self):
+            return None
+
+        def __setstate__(self, state):
+            return None
+
 
 class gordonVP:
     def __init__(self, vobj):
@@ -3,12 +3,28 @@
 __title__ = "import3DM"
 __author__ = "Christophe Grellier (Chris_G) - Keith Sloan (keithsloan52)"
 __license__ = "LGPL 2.1"
-__doc__ = "import of 3DM file"
+__doc__ = """import of 3DM file
+NURBS curves and surfaces are read with the rhino3dm library (pip install rhino3dm).
+The geometry is converted in batches, and stored in one feature per batch and per layer.
+In lazy mode (preference Import3DMLazy), the features are created hidden,
+and their shapes are only built when they are shown."""
 
 import FreeCAD
 import os, io, sys
 import FreeCADGui
 import Part
+import numpy as np
+
+try:
+    import rhino3dm
+    RHINO3DM_AVAILABLE = True
+except ImportError:
+    RHINO3DM_AVAILABLE = False
+
+preferences = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Curves")
+
+# Last parsed 3DM file, shared by the lazy features of this file : (filename, mtime, File3dm)
+last_model = None
 
 if open.__module__ == '__builtin__':
     pythonopen = open # to distinguish python built-in open function from the one declared here
@@ -33,15 +49,200 @@ def insert(filename,docname):
     if filename.lower().endswith('.3dm'):
         process3DM(doc,filename)
 
+def read_model(filename):
+    """Returns the parsed File3dm of filename.
+    Only the last parsed file is kept, and it is parsed again if it changed"""
+    global last_model
+    mtime = os.path.getmtime(filename)
+    if last_model is not None and last_model[:2] == (filename, mtime):
+        return last_model[2]
+    last_model = None
+    model = rhino3dm.File3dm.Read(filename)
+    if model is None:
+        raise RuntimeError("Failed to read {}".format(filename))
+    last_model = (filename, mtime, model)
+    return model
+
+def release_model(filename):
+    "Drops the parsed File3dm of filename, if it is the last parsed file"
+    global last_model
+    if last_model is not None and last_model[0] == filename:
+        last_model = None
+
+def flat_knots(knots):
+    """Returns the knots and multiplicities of a Rhino knot list.
+    Rhino knot lists don't have the superfluous first and last knots"""
+    k = np.array([knots[i] for i in range(len(knots))], dtype=float)
+    k = np.concatenate([k[:1], k, k[-1:]])
+    values, first = np.unique(k, return_index=True)
+    mults = np.diff(np.append(first, len(k)))
+    return values.tolist(), mults.tolist()
+
+def homogeneous_poles(cvs, rational):
+    """Returns the poles and weights arrays of an array of homogeneous control points (x*w, y*w, z*w, w)
+    rational is a bool, or a bool array matching the control points"""
+    cvs = np.asarray(cvs, dtype=float)
+    weights = np.where(rational, cvs[..., 3], 1.0)
+    return cvs[..., :3] / weights[..., None], weights
+
+def to_vectors(poles):
+    return [FreeCAD.Vector(*p) for p in poles]
+
+def curve_cvs(nc):
+    "Returns the (n, 4) array of the homogeneous control points of a rhino3dm.NurbsCurve"
+    pts = nc.Points
+    return np.array([[p.X, p.Y, p.Z, p.W] for p in (pts[i] for i in range(len(pts)))], dtype=float).reshape(-1, 4)
+
+def surface_cvs(ns):
+    "Returns the (nu * nv, 4) array of the homogeneous control points of a rhino3dm.NurbsSurface"
+    pts = ns.Points
+    nu, nv = pts.CountU, pts.CountV
+    return np.array([[p.X, p.Y, p.Z, p.W] for p in (pts[i, j] for i in range(nu) for j in range(nv))], dtype=float).reshape(-1, 4)
+
+def make_curve(nc, poles, weights):
+    "Returns a Part.BSplineCurve from a rhino3dm.NurbsCurve and its poles and weights arrays"
+    knots, mults = flat_knots(nc.Knots)
+    bs = Part.BSplineCurve()
+    bs.buildFromPolesMultsKnots(to_vectors(poles), mults, knots, False, nc.Degree, weights.tolist())
+    return bs
+
+def make_surface(ns, poles, weights):
+    "Returns a Part.BSplineSurface from a rhino3dm.NurbsSurface and its (nu * nv) poles and weights arrays"
+    nu, nv = ns.Points.CountU, ns.Points.CountV
+    poles = poles.reshape(nu, nv, 3)
+    uknots, umults = flat_knots(ns.KnotsU)
+    vknots, vmults = flat_knots(ns.KnotsV)
+    bs = Part.BSplineSurface()
+    bs.buildFromPolesMultsKnots([to_vectors(row) for row in poles], umults, vmults, uknots, vknots,
+                                False, False, ns.OrderU - 1, ns.OrderV - 1, weights.reshape(nu, nv).tolist())
+    return bs
+
+def nurbs_geometries(geom):
+    """Returns the list of the rhino3dm NurbsCurve and NurbsSurface of a rhino3dm geometry.
+    Faces of Breps and extrusions are converted as untrimmed surfaces"""
+    if isinstance(geom, rhino3dm.Extrusion):
+        geom = geom.ToBrep(True)
+    if isinstance(geom, rhino3dm.Brep):
+        surfaces = [face.UnderlyingSurface().ToNurbsSurface() for face in geom.Faces]
+        return [ns for ns in surfaces if ns is not None]
+    if isinstance(geom, rhino3dm.Curve):
+        nurbs = geom.ToNurbsCurve()
+    elif isinstance(geom, rhino3dm.Surface):
+        nurbs = geom.ToNurbsSurface()
+    else:
+        nurbs = None
+    return [] if nurbs is None else [nurbs]
+
+def batch_shape(model, indices):
+    """Returns the compound of the shapes of the objects of model at indices.
+    The control points of all the geometries of the batch are converted
+    to poles and weights in a single array pass.
+    Each curve or surface is then built by its own buildFromPolesMultsKnots call,
+    as OCC has no bulk constructor"""
+    geoms = []
+    for idx in indices:
+        try:
+            geoms.extend((idx, g) for g in nurbs_geometries(model.Objects[idx].Geometry))
+        except Exception as exc:
+            FreeCAD.Console.PrintWarning("3DM object {} skipped : {}\n".format(idx, exc))
+    if not geoms:
+        return Part.Compound([])
+    cvs = [surface_cvs(g) if isinstance(g, rhino3dm.NurbsSurface) else curve_cvs(g) for idx, g in geoms]
+    counts = [len(c) for c in cvs]
+    rational = np.repeat([g.IsRational for idx, g in geoms], counts)
+    poles, weights = homogeneous_poles(np.concatenate(cvs), rational)
+    splits = np.cumsum(counts)[:-1]
+    shapes = []
+    for (idx, g), gp, gw in zip(geoms, np.split(poles, splits), np.split(weights, splits)):
+        try:
+            if isinstance(g, rhino3dm.NurbsSurface):
+                shapes.append(make_surface(g, gp, gw).toShape())
+            else:
+                shapes.append(make_curve(g, gp, gw).toShape())
+        except Exception as exc:
+            FreeCAD.Console.PrintWarning("3DM object {} skipped : {}\n".format(idx, exc))
+    return Part.Compound(shapes)
+
+def object_batches(model, batch_size):
+    "Yields (layer name, list of object indices) batches of the objects of model"
+    layers = [model.Layers[i].Name for i in range(len(model.Layers))]
+    current = dict()
+    for idx in range(len(model.Objects)):
+        layer_idx = model.Objects[idx].Attributes.LayerIndex
+        name = layers[layer_idx] if 0 <= layer_idx < len(layers) else "Default"
+        current.setdefault(name, []).append(idx)
+        if len(current[name]) >= batch_size:
+            yield name, current.pop(name)
+    for name, indices in current.items():
+        yield name, indices
+
+
+class Rhino3dmBatch:
+    """A batch of objects of a 3DM file.
+    In lazy mode, the shape is only built when the feature is visible"""
+    def __init__(self, obj, filename, indices, lazy=False):
+        obj.addProperty("App::PropertyFile", "FileName", "3DM", "The 3DM file").FileName = filename
+        obj.addProperty("App::PropertyIntegerList", "Indices", "3DM", "Indices of the 3DM objects").Indices = indices
+        obj.addProperty("App::PropertyBool", "Lazy", "3DM", "Only build the shape when visible").Lazy = lazy
+        obj.Proxy = self
+
+    def execute(self, obj):
+        if obj.Lazy and not obj.Visibility:
+            return
+        obj.Shape = batch_shape(read_model(obj.FileName), obj.Indices)
+
+    def onChanged(self, obj, prop):
+        if prop == "Visibility" and obj.Visibility and hasattr(obj, "Lazy") and obj.Lazy and obj.Shape.isNull():
+            obj.Shape = batch_shape(read_model(obj.FileName), obj.Indices)
+
+    def unsetupObject(self, obj):
+        # called when the feature is deleted
+        release_model(obj.FileName)
+
+    if FreeCAD.Version()[0] == '0' and '.'.join(FreeCAD.Version()[1:3]) >= '21.2':
+        def dumps(self):
+            return None
+
+        def loads(self, state):
+            return None
+
+    else:
+        def __getstate__(self):
+            return None
+
+        def __setstate__(self, state):
+            return None
+
+
 def process3DM(doc, filename) :
     FreeCAD.Console.PrintMessage('Import 3DM file : '+filename+'\n')
-    FreeCAD.Console.PrintMessage('Import3DM Version 0.1\n')
+    FreeCAD.Console.PrintMessage('Import3DM Version 0.2\n')
 
+    if not RHINO3DM_AVAILABLE:
+        FreeCAD.Console.PrintError("The rhino3dm python module is needed to import 3DM files (pip install rhino3dm)\n")
+        return
     pathName = os.path.dirname(os.path.normpath(filename))
-    print("Add code to parse 3DM file")
+    lazy = preferences.GetBool("Import3DMLazy", False)
+    batch_size = max(1, preferences.GetInt("Import3DMBatchSize", 500))
+    model = read_model(filename)
+    groups = dict()
+    for layer, indices in object_batches(model, batch_size):
+        if layer not in groups:
+            groups[layer] = doc.addObject("App::DocumentObjectGroup", "Layer")
+            groups[layer].Label = layer
+        fp = doc.addObject("Part::FeaturePython", "Rhino3dm")
+        fp.Label = "{}_{}".format(layer, indices[0])
+        Rhino3dmBatch(fp, filename, indices, lazy)
+        if FreeCAD.GuiUp:
+            fp.ViewObject.Proxy = 0
+        if lazy:
+            fp.Visibility = False
+        else:
+            fp.Shape = batch_shape(model, indices)
+            fp.purgeTouched()
+        groups[layer].addObject(fp)
+    if not lazy:
+        # the geometry is now stored in the features
+        release_model(filename)
 
     FreeCAD.Console.PrintMessage('3DM File Imported\n')
-
-
-    
-
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import numpy as np
+
+
+def boxes_overlap(box1, box2):
+    'Returns True if the two boxes (xmin, ymin, zmin, xmax, ymax, zmax) overlap'
+    return bool(np.all(box1[:3] <= box2[3:]) and np.all(box2[:3] <= box1[3:]))
+
+
+def points_box(points, tol=0.0):
+    'Returns the box (xmin, ymin, zmin, xmax, ymax, zmax) of an array of 3D points, enlarged by tol'
+    pts = np.asarray(points, dtype=float).reshape(-1, 3)
+    return np.concatenate([pts.min(axis=0) - tol, pts.max(axis=0) + tol])
+
+
+class AABBTree:
+    '''
+    Axis Aligned Bounding Box tree.
+    Spatial index of a list of boxes, to quickly find the boxes
+    that overlap a given box.
+
+    Boxes are arrays of 6 floats : (xmin, ymin, zmin, xmax, ymax, zmax)
+
+    Example:
+    tree = AABBTree(boxes)
+    tree.query(box) -> list of indices of the boxes that overlap box
+    '''
+
+    def __init__(self, boxes, leaf_size=4):
+        '''
+        Build the tree.
+
+        Attributes:
+            boxes: an array of shape (n, 6)
+            leaf_size: max number of boxes in a leaf node
+        '''
+        self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 6)
+        self.leaf_size = max(1, leaf_size)
+        self.root = None
+        if len(self.boxes) > 0:
+            self.root = self._build(np.arange(len(self.boxes)))
+
+    def __repr__(self):
+        return f"AABBTree ({len(self.boxes)} boxes)"
+
+    def _build(self, indices):
+        'Recursively build the nodes : (box, children, indices)'
+        sub = self.boxes[indices]
+        box = np.concatenate([sub[:, :3].min(axis=0), sub[:, 3:].max(axis=0)])
+        if len(indices) <= self.leaf_size:
+            return (box, None, indices)
+        # split at the median of the box centers, along the largest axis
+        centers = 0.5 * (sub[:, :3] + sub[:, 3:])
+        axis = int(np.argmax(box[3:] - box[:3]))
+        order = np.argsort(centers[:, axis], kind="stable")
+        half = len(indices) // 2
+        children = (self._build(indices[order[:half]]),
+                    self._build(indices[order[half:]]))
+        return (box, children, indices)
+
+    def query(self, box):
+        'Returns the sorted list of indices of the boxes that overlap box'
+        box = np.asarray(box, dtype=float)
+        result = []
+        if self.root is None:
+            return result
+        stack = [self.root]
+        while stack:
+            node_box, children, indices = stack.pop()
+            if not boxes_overlap(node_box, box):
+                continue
+            if children is None:
+                sub = self.boxes[indices]
+                mask = np.all(sub[:, :3] <= box[3:], axis=1) & np.all(box[:3] <= sub[:, 3:], axis=1)
+                result.extend(indices[mask].tolist())
+            else:
+                stack.extend(children)
+        return sorted(result)
+
+    def query_boxes(self, boxes):
+        'Returns a list of overlapping indices, for each box of an array of boxes'
+        return [self.query(box) for box in np.asarray(boxes, dtype=float).reshape(-1, 6)]
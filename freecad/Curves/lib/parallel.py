@@ -0,0 +1,73 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+"""Process pool helper of the workbench.
+
+Worker processes are only used without GUI (FreeCADCmd, or FreeCAD as a python module) :
+- forking the GUI process duplicates the Qt application
+- spawning re-executes sys.executable, that is the FreeCAD binary, not a python interpreter
+In the GUI, the tasks are always computed serially.
+
+On Linux, the workers are forked.
+On other platforms, they are spawned with the python interpreter of the FreeCAD installation.
+If no interpreter is found, the tasks are computed serially.
+"""
+
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import FreeCAD
+
+
+def python_executable():
+    "Returns the path of the python interpreter of the FreeCAD installation, or None"
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    if sys.platform == "win32":
+        candidates = [os.path.join(sys.prefix, "python.exe"),
+                      os.path.join(os.path.dirname(sys.executable), "python.exe")]
+    else:
+        candidates = [os.path.join(sys.prefix, "bin", "python3"),
+                      os.path.join(os.path.dirname(sys.executable), "python3")]
+    for exe in candidates:
+        if os.path.isfile(exe):
+            return exe
+    return None
+
+
+def pool_context():
+    "Returns the multiprocessing context of the worker processes, or None if processes can't be used"
+    if FreeCAD.GuiUp:
+        return None
+    if sys.platform.startswith("linux"):
+        return multiprocessing.get_context("fork")
+    exe = python_executable()
+    if exe is None:
+        return None
+    ctx = multiprocessing.get_context("spawn")
+    ctx.set_executable(exe)
+    return ctx
+
+
+def process_map(func, tasks, nb_workers=1, chunksize=1, timeout=None, name="Parallel computation"):
+    """Returns the list of the results of func on each task.
+    If nb_workers > 1, the tasks are dispatched to a pool of nb_workers processes.
+    func must be a module level function, and tasks must be picklable.
+    If the pool can't be used, fails, or doesn't finish within timeout (in seconds),
+    the tasks are computed serially"""
+    tasks = list(tasks)
+    nb_workers = min(nb_workers, len(tasks))
+    ctx = pool_context() if nb_workers > 1 else None
+    if nb_workers > 1 and ctx is None:
+        FreeCAD.Console.PrintLog("{} : worker processes are not available, using serial computation\n".format(name))
+    if ctx is not None:
+        executor = ProcessPoolExecutor(max_workers=nb_workers, mp_context=ctx)
+        try:
+            return list(executor.map(func, tasks, chunksize=chunksize, timeout=timeout))
+        except Exception as exc:
+            FreeCAD.Console.PrintError("{} failed ({}). Switching to serial computation\n".format(name, exc))
+        finally:
+            # don't wait for hanging workers
+            executor.shutdown(wait=False)
+    return [func(task) for task in tasks]
@@ -0,0 +1,195 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import FreeCAD
+from freecad.Curves.lib.logger import FCLogger
+
+
+class Tracer:
+    """
+    Central instrumentation tool of the workbench :
+    named nested spans, counters, and timing of FeaturePython recomputes.
+    It is disabled by default, and spans cost almost nothing when disabled.
+    The trace can be exported in Chrome trace event format,
+    that can be opened in chrome://tracing or https://ui.perfetto.dev
+
+    Example:
+    from freecad.Curves.lib.profiler import tracer
+    tracer.enable()
+    tracer.trace_features()
+    FreeCAD.ActiveDocument.recompute()
+    tracer.report()
+    tracer.export("/tmp/trace.json")
+    tracer.disable()
+
+    In the code:
+    with tracer.span("skinning", nb_curves=len(curves)):
+        ...
+    tracer.count("intersections")
+
+    @tracer.traced()
+    def my_function():
+        ...
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.log = FCLogger("Info", "Tracer")
+        self.log.IncludeFuncName = False
+        self._patched = dict()
+        self._local = threading.local()
+        self.reset()
+
+    def __repr__(self):
+        state = "enabled" if self.enabled else "disabled"
+        return f"Tracer ({state}, {len(self.events)} events, {len(self.counters)} counters)"
+
+    def enable(self, reset=True):
+        "Start recording. Previous records are cleared if reset is True"
+        if reset:
+            self.reset()
+        self.enabled = True
+
+    def disable(self):
+        "Stop recording, and restore the FeaturePython execute methods"
+        self.enabled = False
+        self.untrace_features()
+
+    def reset(self):
+        "Clear all the records"
+        self.events = []
+        self.counters = dict()
+        self._t0 = time.perf_counter()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, **args):
+        "Context manager that records the duration of a named span"
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        parent = stack[-1] if stack else ""
+        stack.append(name)
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            toc = time.perf_counter()
+            stack.pop()
+            args.update(depth=len(stack), parent=parent)
+            self.events.append({"name": name,
+                                "ph": "X",
+                                "ts": (tic - self._t0) * 1e6,
+                                "dur": (toc - tic) * 1e6,
+                                "pid": os.getpid(),
+                                "tid": threading.get_ident(),
+                                "args": args})
+
+    def traced(self, name=None):
+        "Decorator that records each call of a function as a span"
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, value=1):
+        "Increment a named counter"
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+        self.events.append({"name": name,
+                            "ph": "C",
+                            "ts": (time.perf_counter() - self._t0) * 1e6,
+                            "pid": os.getpid(),
+                            "tid": threading.get_ident(),
+                            "args": {name: self.counters[name]}})
+
+    def trace_features(self, doc=None):
+        """Record the execute method of the FeaturePython objects of doc
+        (default : all open documents) as spans named 'ProxyClass.execute'"""
+        docs = [doc] if doc is not None else FreeCAD.listDocuments().values()
+        for d in docs:
+            for obj in d.Objects:
+                proxy = getattr(obj, "Proxy", None)
+                cls = type(proxy)
+                if proxy is None or cls in self._patched or not callable(getattr(cls, "execute", None)):
+                    continue
+                self._patched[cls] = cls.__dict__.get("execute")
+                cls.execute = self._traced_execute(cls, cls.execute)
+
+    def _traced_execute(self, cls, original):
+        span_name = f"{cls.__name__}.execute"
+
+        @functools.wraps(original)
+        def execute(proxy, fp, *args, **kwargs):
+            if not self.enabled:
+                return original(proxy, fp, *args, **kwargs)
+            self.count("execute")
+            with self.span(span_name, object=fp.Name, label=fp.Label):
+                return original(proxy, fp, *args, **kwargs)
+        return execute
+
+    def untrace_features(self):
+        "Restore the original execute methods"
+        for cls, original in self._patched.items():
+            if original is None:
+                del cls.execute
+            else:
+                cls.execute = original
+        self._patched = dict()
+
+    def summary(self):
+        """Returns a dictionary of the spans statistics :
+        {name: {"calls": int, "total": seconds, "max": seconds}}"""
+        stats = dict()
+        for ev in self.events:
+            if not ev["ph"] == "X":
+                continue
+            st = stats.setdefault(ev["name"], {"calls": 0, "total": 0.0, "max": 0.0})
+            st["calls"] += 1
+            st["total"] += ev["dur"] * 1e-6
+            st["max"] = max(st["max"], ev["dur"] * 1e-6)
+        return stats
+
+    def report(self, limit=30):
+        "Print the spans with highest total time, and the counters"
+        stats = sorted(self.summary().items(), key=lambda it: it[1]["total"], reverse=True)
+        lines = ["{:<50} {:>7} {:>10} {:>10}".format("Span", "Calls", "Total (s)", "Max (s)")]
+        for name, st in stats[:limit]:
+            lines.append(f"{name:<50} {st['calls']:>7} {st['total']:>10.4f} {st['max']:>10.4f}")
+        for name, val in sorted(self.counters.items()):
+            lines.append(f"{name:<50} {val:>7}")
+        self.log.info("\n" + "\n".join(lines))
+
+    def to_dict(self):
+        "Returns the trace as a Chrome trace event dictionary"
+        return {"traceEvents": list(self.events),
+                "displayTimeUnit": "ms",
+                "otherData": {"counters": dict(self.counters)}}
+
+    def export(self, filename):
+        "Save the trace to a json file, in Chrome trace event format"
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f)
+
+
+# Global tracer of the workbench
+tracer = Tracer()
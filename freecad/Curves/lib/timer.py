@@ -3,13 +3,16 @@
 from FreeCAD import Console
 import time
 
+from freecad.Curves.lib.profiler import tracer
+
 
 def timer(logger=None):
     'Timer decorator for normal functions'
     def timerdec(func):
         def wrapper_timer(*args, **kwargs):
             tic = time.perf_counter()
-            value = func(*args, **kwargs)
+            with tracer.span(func.__qualname__):
+                value = func(*args, **kwargs)
             toc = time.perf_counter()
             elapsed_time = toc - tic
             mess = f"{func.__name__}: {elapsed_time:0.4f} seconds"
@@ -27,7 +30,8 @@ def cls_timer(func):
 
     def wrapper_timer(self, *args, **kwargs):
         tic = time.perf_counter()
-        value = func(self, *args, **kwargs)
+        with tracer.span(func.__qualname__):
+            value = func(self, *args, **kwargs)
         toc = time.perf_counter()
         elapsed_time = toc - tic
         mess = f"{func.__name__}: {elapsed_time:0.4f} seconds"
@@ -7,6 +7,9 @@ __doc__ = "Collection of tools for Nurbs."
 
 import FreeCAD
 import Part
+import numpy as np
+from itertools import product
+from freecad.Curves.lib.aabb_tree import AABBTree, points_box
 
 message = FreeCAD.Console.PrintMessage
 
@@ -35,11 +38,16 @@ def is_same(c1, c2, tol=1e-7, full=False):  # Check if BSpline curves c1 and c2
     """Check if BSpline curves c1 and c2 are equal
     return a bool
     """
+    return is_same_data(get_bspline_data(c1), get_bspline_data(c2), tol, full)
+
+
+def is_same_data(dat1, dat2, tol=1e-7, full=False):
+    """Check if two BSpline data dictionaries (see get_bspline_data) are equal
+    return a bool
+    """
     valid = True
     if full:
         message("\nCurves comparison\n")
-    dat1 = get_bspline_data(c1)
-    dat2 = get_bspline_data(c2)
     for key in ['Type', 'Continuity', 'Degree', 'isClosed', 'isPeriodic', 'isRational']:
         if not dat1[key] == dat2[key]:
             if full:
@@ -89,24 +97,105 @@ def is_same(c1, c2, tol=1e-7, full=False):  # Check if BSpline curves c1 and c2
     return True
 
 
-def remove_duplicates(curves, tol=1e-7):  # remove duplicate curves from a list
-    "remove duplicate curves from a list"
+def bspline_fingerprint(dat, size):
+    """returns a hashable fingerprint of BSpline data (see get_bspline_data) :
+    (structure key, grid cell of the poles centroid)
+    The fingerprint doesn't depend on the curve orientation.
+    Equal curves, within tolerance tol, have the same structure key
+    and neighbour cells, if size >= 2 * tol"""
+    key = (dat["Type"], dat["Continuity"], dat["Degree"], dat["isClosed"], dat["isPeriodic"], dat["isRational"],
+           len(dat["KnotSequence"]), len(dat["Poles"]))
+    center = np.mean([(p.x, p.y, p.z) for p in dat["Poles"]], axis=0)
+    cell = tuple(np.floor(center / size).astype(int).tolist())
+    return key, cell
+
+
+def remove_duplicates(curves, tol=1e-7, reverse=False):  # remove duplicate curves from a list
+    """remove duplicate curves from a list
+    The kept curves are indexed by their fingerprint (see bspline_fingerprint),
+    so that each curve is only compared to the kept curves
+    of same structure, and close poles centroid.
+    If reverse is True, a reversed curve is also considered as a duplicate"""
     ret = []
+    index = dict()
+    size = 2 * max(tol, 1e-12)
     dups = 0
-    for i, c1 in enumerate(curves):
+    for c1 in curves:
+        dat = get_bspline_data(c1)
+        datas = [dat]
+        if reverse:
+            rc = c1.copy()
+            rc.reverse()
+            datas.append(get_bspline_data(rc))
+        key, cell = bspline_fingerprint(dat, size)
         found = False
-        for j, c2 in enumerate(ret):
-            # print("checking curves #{} and #{}".format(i,j+i+1))
-            if is_same(c1, c2, tol):
-                found = True
-                dups += 1
+        for offset in product((-1, 0, 1), repeat=3):
+            ncell = tuple(c + o for c, o in zip(cell, offset))
+            for dat2 in index.get((key, ncell), []):
+                if any(is_same_data(d, dat2, tol) for d in datas):
+                    found = True
+                    break
+            if found:
                 break
-        if not found:
+        if found:
+            dups += 1
+        else:
             ret.append(c1)
+            index.setdefault((key, cell), []).append(dat)
     message("Removed {} duplicate curves\n".format(dups))
     return ret
 
 
+def to_edge(edge):
+    "Returns the edge shape of a curve, or the edge itself"
+    try:
+        return edge.toShape()
+    except AttributeError:
+        return edge
+
+
+def projected_points(points, edge):
+    """Returns the array of the projections of points on the curve of edge, within the edge range.
+    Non-rational BSpline curves are projected all at once (see project_on_bspline),
+    other curves with one curve.parameter call per point."""
+    curve = edge.Curve
+    fp, lp = edge.ParameterRange
+    if isinstance(curve, Part.BSplineCurve) and not curve.isRational():
+        if curve.isPeriodic():
+            curve = curve.copy()
+            curve.setNotPeriodic()
+        if curve.FirstParameter <= fp and lp <= curve.LastParameter:
+            coords = np.array([(p.x, p.y, p.z) for p in points], dtype=float)
+            poles = np.array(curve.getPoles(), dtype=float)
+            params = project_on_bspline(curve.Degree, curve.KnotSequence, poles, coords, bounds=(fp, lp))[0]
+            return bspline_derivatives(curve.Degree, curve.KnotSequence, poles, params)[:, 0]
+        curve = edge.Curve
+    params = [min(max(curve.parameter(p), fp), lp) for p in points]
+    return np.array([curve.value(t) for t in params], dtype=float)
+
+
+def points_on_edge(points, edge, tol=1e-7):
+    """check that all points are closer than tol to edge.
+    The points are projected on the edge (see projected_points),
+    and the points that fail this check are checked again with distToShape,
+    the end points first, since they are the most likely to fail."""
+    nb = len(points)
+    if nb == 0:
+        return True
+    coords = np.array([(p.x, p.y, p.z) for p in points], dtype=float)
+    try:
+        dist = np.linalg.norm(coords - projected_points(points, edge), axis=1)
+    except (Part.OCCError, TypeError):
+        dist = np.full(nb, np.inf)
+    failed = set(np.nonzero(dist > tol)[0].tolist())
+    order = [i for i in (0, nb - 1) if i in failed] + sorted(failed - {0, nb - 1})
+    for i in order:
+        d, pts, info = Part.Vertex(points[i]).distToShape(edge)
+        if d > tol:
+            return False
+    return True
+
+
 def is_subsegment(edge_1, edge_2, num=20, tol=1e-7):  # check if edge_1 is a trim of edge_2.
     """check if edge_1 is a trim of edge_2.
     Usage :
@@ -114,42 +203,50 @@ def is_subsegment(edge_1, edge_2, num=20, tol=1e-7):  # check if edge_1 is a tri
     'num' points are sampled on edge_1
     return False if a point is farther than tol.
     """
-    try:
-        e1 = edge_1.toShape()
-        e2 = edge_2.toShape()
-    except AttributeError:
-        e1 = edge_1
-        e2 = edge_2
-    for p in e1.discretize(num):
-        d, pts, info = Part.Vertex(p).distToShape(e2)
-        if d > tol:
-            return False
-    return True
+    e1 = to_edge(edge_1)
+    e2 = to_edge(edge_2)
+    return points_on_edge(e1.discretize(num), e2, tol)
 
 
 def remove_subsegments(edges, num=20, tol=1e-7):  # remove subsegment edges from a list
-    "remove subsegment edges from a list"
+    """remove subsegment edges from a list
+    The edges are indexed in an AABB tree, so that each edge is only
+    compared to the edges whose bounding box contains its sample points."""
+    shapes = [to_edge(e) for e in edges]
+    samples = [sh.discretize(num) for sh in shapes]
+    sample_boxes = np.array([points_box([(p.x, p.y, p.z) for p in pts]) for pts in samples]).reshape(-1, 6)
+    edge_boxes = []
+    for sh in shapes:
+        bb = sh.BoundBox
+        edge_boxes.append([bb.XMin - tol, bb.YMin - tol, bb.ZMin - tol, bb.XMax + tol, bb.YMax + tol, bb.ZMax + tol])
+    edge_boxes = np.array(edge_boxes).reshape(-1, 6)
+    tree = AABBTree(edge_boxes)
+
+    def contains(i, j):
+        "check if the box of edge j contains the sample points of edge i"
+        return bool(np.all(edge_boxes[j][:3] <= sample_boxes[i][:3]) and np.all(sample_boxes[i][3:] <= edge_boxes[j][3:]))
+
+    def on_edge(i, j):
+        return contains(i, j) and points_on_edge(samples[i], shapes[j], tol)
+
     ret = []
     dups = 0
-    for i, e1 in enumerate(edges):
+    for i in range(len(shapes)):
         found = False
-        for j, e2 in enumerate(edges):
-            if not i == j:
-                if is_subsegment(e1, e2, num, tol):
-                    if is_subsegment(e2, e1, num, tol):  # e1 == e2
-                        for k, e3 in enumerate(ret):
-                            if is_subsegment(e1, e3, num, tol):
-                                found = True
-                                dups += 1
-                                break
-                    else:
-                        found = True
-                        dups += 1
-                        break
+        for j in tree.query(sample_boxes[i]):
+            if i == j or not on_edge(i, j):
+                continue
+            if on_edge(j, i):  # e1 == e2
+                found = any(on_edge(i, k) for k in ret)
+            else:
+                found = True
+            if found:
+                dups += 1
+                break
         if not found:
-            ret.append(e1)
+            ret.append(i)
     message("Removed {} subsegment edges\n".format(dups))
-    return ret
+    return [edges[i] for i in ret]
 
 
 class BsplineBasis(object):
@@ -274,6 +371,166 @@ class BsplineBasis(object):
             f[span - self.degree + i] = val
         return f
 
+    def find_spans(self, params):
+        """ Determine the knot span indices of an array of parameters.
+        Vectorized version of find_span.
+        - input: parameters (array of floats)
+        - output: the knot span indices (array of ints)
+        """
+        knots = np.asarray(self.knots, dtype=float)
+        n = len(knots) - self.degree - 1
+        spans = np.searchsorted(knots, np.asarray(params, dtype=float), side='right') - 1
+        return np.clip(spans, self.degree, n - 1)
+
+    def ders_basis_funs_array(self, spans, params, n):
+        """ Compute nonzero basis functions and their derivatives
+        for an array of parameters, in a single vectorized pass.
+        Vectorized version of ders_basis_funs.
+        - input: span indices (array of ints), parameters (array of floats),
+          number of derivatives n (int)
+        - output: basis functions and derivatives (array of shape (len(params), n + 1, degree + 1))
+        Nurbs Book Algo A2.3 p.72
+        """
+        p = self.degree
+        knots = np.asarray(self.knots, dtype=float)
+        u = np.atleast_1d(np.asarray(params, dtype=float))
+        spans = np.atleast_1d(np.asarray(spans, dtype=int))
+        m = len(u)
+        ders = np.zeros((m, n + 1, p + 1))
+        ndu = np.ones((m, p + 1, p + 1))
+        left = np.zeros((m, p + 1))
+        right = np.zeros((m, p + 1))
+        for j in range(1, p + 1):
+            left[:, j] = u - knots[spans + 1 - j]
+            right[:, j] = knots[spans + j] - u
+            saved = np.zeros(m)
+            for r in range(j):
+                ndu[:, j, r] = right[:, r + 1] + left[:, j - r]
+                temp = ndu[:, r, j - 1] / ndu[:, j, r]
+                ndu[:, r, j] = saved + right[:, r + 1] * temp
+                saved = left[:, j - r] * temp
+            ndu[:, j, j] = saved
+
+        ders[:, 0, :] = ndu[:, :, p]
+        # derivatives of order higher than degree are null
+        nd = min(n, p)
+        for r in range(0, p + 1):
+            s1 = 0
+            s2 = 1
+            a = np.zeros((2, m, p + 1))
+            a[0, :, 0] = 1.0
+            for k in range(1, nd + 1):
+                d = np.zeros(m)
+                rk = r - k
+                pk = p - k
+                if r >= k:
+                    a[s2, :, 0] = a[s1, :, 0] / ndu[:, pk + 1, rk]
+                    d = a[s2, :, 0] * ndu[:, rk, pk]
+                if rk >= -1:
+                    j1 = 1
+                else:
+                    j1 = -rk
+                if (r - 1) <= pk:
+                    j2 = k - 1
+                else:
+                    j2 = p - r
+                if j2 >= j1:
+                    a[s2, :, j1:j2 + 1] = (a[s1, :, j1:j2 + 1] - a[s1, :, j1 - 1:j2]) / ndu[:, pk + 1, rk + j1:rk + j2 + 1]
+                    d += np.sum(a[s2, :, j1:j2 + 1] * ndu[:, rk + j1:rk + j2 + 1, pk], axis=1)
+                if r <= pk:
+                    a[s2, :, k] = -a[s1, :, k - 1] / ndu[:, pk + 1, r]
+                    d += a[s2, :, k] * ndu[:, r, pk]
+                ders[:, k, r] = d
+                s1, s2 = s2, s1
+        r = p
+        for k in range(1, nd + 1):
+            ders[:, k, :] *= r
+            r *= (p - k)
+        return ders
+
+    def evaluate_array(self, params, d):
+        """ Compute the derivative d of the nonzero basis functions
+        for an array of parameters, in a single vectorized pass.
+        - input: parameters (array of floats), derivative d (int)
+        - output: (spans, values) where spans is an array of knot span indices
+          and values an array of shape (len(params), degree + 1).
+          values[i][j] is the value of basis function (spans[i] - degree + j) at params[i]
+        """
+        spans = self.find_spans(params)
+        ders = self.ders_basis_funs_array(spans, params, d)
+        return spans, ders[:, d, :]
+
+
+def bspline_derivatives(degree, knots, poles, params, n=0):
+    """ Evaluate a non-rational BSpline curve and its n first derivatives
+    at an array of parameters, in a single vectorized pass.
+    - input: degree (int), flat knot sequence, poles (array of shape (nb_poles, dim)),
+      parameters (array of floats), number of derivatives n (int)
+    - output: array of shape (len(params), n + 1, dim)
+    """
+    bb = BsplineBasis()
+    bb.knots = knots
+    bb.degree = degree
+    params = np.atleast_1d(np.asarray(params, dtype=float))
+    spans = bb.find_spans(params)
+    ders = bb.ders_basis_funs_array(spans, params, n)
+    idx = spans[:, None] - degree + np.arange(degree + 1)
+    return np.einsum('mkj,mjc->mkc', ders, np.asarray(poles, dtype=float)[idx])
+
+
+def project_on_bspline(degree, flatKnots, poles, pnts, initialParms=None, maxIter=10, eps=1e-6, nb_samples=None, bounds=None):
+    """Project an array of points on a non-rational BSpline curve, all at once.
+    The initial guess of each point is the closest of its initial parameter
+    and of nb_samples parameters sampled on the curve.
+    It is then refined by vectorized Newton iterations.
+    The parameters are searched in bounds (umin, umax), the curve range by default.
+    If initialParms is None, only the samples are used as initial guess.
+    Returns (parameters, number of Newton iterations, max parameter step of last iteration)"""
+    poles = np.asarray(poles, dtype=float)
+    pnts = np.asarray(pnts, dtype=float)
+    if bounds is None:
+        umin, umax = flatKnots[degree], flatKnots[-degree - 1]
+    else:
+        umin, umax = bounds
+    if initialParms is None:
+        initialParms = [umin] * len(pnts)
+    t = np.clip(np.array(initialParms, dtype=float), umin, umax)
+    if nb_samples is None:
+        nb_samples = max(10 * len(poles), 100)
+
+    #  initial guess
+    samples = np.linspace(umin, umax, nb_samples)
+    sampled_pts = bspline_derivatives(degree, flatKnots, poles, samples)[:, 0]
+    current_pts = bspline_derivatives(degree, flatKnots, poles, t)[:, 0]
+    current_dist = np.sum((current_pts - pnts) ** 2, axis=1)
+    chunk = max(1, 1000000 // nb_samples)
+    for start in range(0, len(pnts), chunk):
+        sl = slice(start, start + chunk)
+        dist = np.sum((pnts[sl, None, :] - sampled_pts[None, :, :]) ** 2, axis=2)
+        nearest = np.argmin(dist, axis=1)
+        closer = dist[np.arange(len(nearest)), nearest] < current_dist[sl]
+        t[sl] = np.where(closer, samples[nearest], t[sl])
+
+    #  newton iterations on the points that have not converged yet
+    active = np.arange(len(t))
+    itera = 0
+    max_step = 0.
+    while len(active) > 0 and itera < maxIter:
+        ders = bspline_derivatives(degree, flatKnots, poles, t[active], 2)
+        diff = ders[:, 0] - pnts[active]
+        df = np.sum(diff * ders[:, 1], axis=1)
+        d2f = np.sum(diff * ders[:, 2], axis=1) + np.sum(ders[:, 1] ** 2, axis=1)
+        dt = np.zeros(len(active))
+        valid = d2f > 0
+        dt[valid] = -df[valid] / d2f[valid]
+        t_new = np.clip(t[active] + dt, umin, umax)
+        steps = np.abs(t_new - t[active])
+        t[active] = t_new
+        max_step = float(np.max(steps))
+        active = active[steps >= eps]
+        itera += 1
+    return t, itera, max_step
+
 
 class KnotVector(object):
     """Knot vector object to use in Bsplines"""